@@ -1,17 +1,36 @@
 import os
-import os, secrets, urllib.parse, requests
+import os, secrets, urllib.parse
+from collections import Counter
+from datetime import datetime, timedelta
 from flask import Flask, redirect, request, session, url_for, abort
 from werkzeug.middleware.proxy_fix import ProxyFix
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
-from sqlalchemy import create_engine
-from sqlalchemy.orm import scoped_session, sessionmaker
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, Response, stream_with_context
+from sqlalchemy import create_engine, or_, update
+from sqlalchemy.orm import scoped_session, sessionmaker, joinedload, load_only, selectinload
 
-from models import Base, EmailItem, Photo, Status
+from models import EmailItem, Photo, Status
+from migrations import migrate
+import search
+import export
+from pagination import keyset_page, DEFAULT_PAGE_SIZE
 from config import load_config
 from gmail_client import GmailManager
 from drive_client import DriveManager
 from token_store import DBTokenStore
-from tasks import scan_gmail_accounts, send_daily_summary
+from google_api import EXECUTOR
+from metrics import METRICS, instrument_engine
+from tasks import scan_gmail_accounts, send_daily_summary, drain_outbox, backfill_received_at
+from scheduler import JobScheduler
+from view_cache import ViewCache, TTLValue, bump_version
+import thumbnails
+import rollups
+import classifier
+
+BULK_STATUS_MAX = 1000  # ids per bulk status request (one IN list)
+STATUSES = {s.value for s in Status}
+# Columns the dashboard list renders; photo ids come in one selectin query for the counts
+LIST_COLUMNS = (EmailItem.sender, EmailItem.subject, EmailItem.snippet, EmailItem.account_email,
+                EmailItem.status, EmailItem.priority, EmailItem.received_at, EmailItem.created_at)
 
 # --- Load config FIRST ---
 CFG = load_config()
@@ -24,14 +43,26 @@ app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_port=1)
 app.secret_key = CFG['FLASK_SECRET_KEY']
 
 # --- Database ---
-engine = create_engine(CFG['DATABASE_URL'], future=True)
-Base.metadata.create_all(engine)
-Session = scoped_session(sessionmaker(bind=engine, autoflush=False))
+# A scan holds one connection per inbox plus one per message worker, and each scheduled job
+# (4) may hold its leader-lock connection and a session. Those exist only while jobs run,
+# so they are pool overflow on top of what web requests use.
+SCAN_CONNECTIONS = CFG['SCAN_ACCOUNT_WORKERS'] * (CFG['SCAN_MESSAGE_WORKERS'] + 1)
+JOB_CONNECTIONS = 2 * 4
+# SQLite (dev) serializes writers; wait longer than the 5s default for the write lock
+engine = create_engine(CFG['DATABASE_URL'], future=True, pool_size=CFG['DB_POOL_SIZE'],
+                       max_overflow=CFG['DB_POOL_OVERFLOW'] + SCAN_CONNECTIONS + JOB_CONNECTIONS,
+                       connect_args={'timeout': 30} if CFG['DATABASE_URL'].startswith('sqlite') else {})
+instrument_engine(engine)
+# Schema changes are applied by `python migrations.py` (or `flask --app app migrate`) before start
+SessionFactory = sessionmaker(bind=engine, autoflush=False)
+Session = scoped_session(SessionFactory)
 
 # --- Token store ---
 token_store = DBTokenStore(Session)
 
 # --- Google managers ---
+EXECUTOR.configure(rates={'gmail': CFG['GMAIL_QUOTA_UNITS_PER_SEC'], 'drive': CFG['DRIVE_REQUESTS_PER_SEC']})
+
 gmail_mgr = GmailManager(
     client_secrets_file=CFG['GOOGLE_CLIENT_SECRETS'],
     token_store=token_store,
@@ -41,59 +72,227 @@ gmail_mgr = GmailManager(
 drive_mgr = DriveManager(
     client_secrets_file=CFG['GOOGLE_CLIENT_SECRETS'],
     token_dir=CFG.get('GOOGLE_TOKEN_DIR', 'tokens'),
-    scopes=CFG['OAUTH_SCOPES'].split()
+    scopes=CFG['OAUTH_SCOPES'].split(),
+    upload_folder_id=CFG['DRIVE_UPLOAD_FOLDER_ID'] or None,
+    upload_workers=CFG['DRIVE_UPLOAD_WORKERS'],
 )
 
+def _load_connection_badge():
+    # Token existence only: loading (and possibly refreshing) credentials would pull in google-auth
+    service_account = CFG.get('SERVICE_GOOGLE_ACCOUNT') or ''
+    has_drive = bool(service_account and drive_mgr.has_token(service_account))
+    return tuple(gmail_mgr.list_connected_accounts()), has_drive
+
+# Rendered item lists, invalidated by bump_version() on status updates and scans
+item_views = ViewCache(SessionFactory, version_ttl=CFG['DASHBOARD_VERSION_TTL'])
+# Token lookups (and a possible Drive token refresh) are too slow for every page view
+connection_badge = TTLValue(_load_connection_badge, CFG['DASHBOARD_BADGE_TTL'])
+thumbnail_cache = thumbnails.ThumbnailCache(CFG['THUMBNAIL_CACHE_MB'] * 1024 * 1024)
+
 @app.teardown_appcontext
 def shutdown_session(exception=None):
     Session.remove()
 
-@app.route('/')
-def index():
-    session_db = Session()
-    q = session_db.query(EmailItem).order_by(EmailItem.created_at.desc())
+def _filter_items(q, args):
+    """Apply the list filters (status, priority, q) in args to an EmailItem query."""
+    status = args.get('status')
+    kw = args.get('q', '').strip()
+    if status in STATUSES:
+        q = q.filter(EmailItem.status == Status[status])
+    priority = args.get('priority')
+    if priority == classifier.PRIORITY_LOW:
+        q = q.filter(EmailItem.priority == classifier.PRIORITY_LOW)
+    elif priority == classifier.PRIORITY_NORMAL:
+        # Items stored before the classifier have no priority and count as normal
+        q = q.filter(or_(EmailItem.priority.is_(None), EmailItem.priority != classifier.PRIORITY_LOW))
+    if kw:
+        search.detect(engine)
+        q = search.apply(q, kw, engine.dialect.name)
+    return q
 
-    status = request.args.get('status')
-    kw = request.args.get('q', '').strip()
+def _list_items(args, *options):
+    """One keyset page of tracked items for the list filters in args.
 
-    if status in {'NEW', 'RESOLVED', 'CREDIT_RECEIVED'}:
-        q = q.filter(EmailItem.status == Status[status])
+    Returns (items, next_cursor, prev_cursor). Search results are ordered by
+    relevance, everything else newest first. options are loader options for the rows.
+    """
+    q = _filter_items(Session().query(EmailItem).options(*options), args)
+    kw = args.get('q', '').strip()
+    rank = search.relevance(kw, engine.dialect.name) if kw else None
 
-    if kw:
-        like = f"%{kw}%"
-        q = q.filter(
-            (EmailItem.subject.ilike(like)) |
-            (EmailItem.snippet.ilike(like)) |
-            (EmailItem.sender.ilike(like))
-        )
+    limit = args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    if rank:
+        rank_expr, rank_desc = rank
+        rows, next_cursor, prev_cursor = keyset_page(
+            q.add_columns(rank_expr.label('rank')),
+            [(rank_expr, rank_desc), (EmailItem.id, True)],
+            lambda r: (r.rank, r[0].id),
+            after=args.get('after'), before=args.get('before'), limit=limit)
+        items = [r[0] for r in rows]
+    else:
+        # Rows get received_at on ingest or from the backfill job; NULLs cannot be keyset-paged
+        items, next_cursor, prev_cursor = keyset_page(
+            q.filter(EmailItem.received_at.isnot(None)),
+            [(EmailItem.received_at, True), (EmailItem.id, True)],
+            lambda i: (i.received_at, i.id),
+            after=args.get('after'), before=args.get('before'), limit=limit)
+    return items, next_cursor, prev_cursor
 
-    items = q.limit(300).all()
+def _item_json(item):
+    return {
+        'id': item.id,
+        'gmail_message_id': item.gmail_message_id,
+        'thread_id': item.thread_id,
+        'account_email': item.account_email,
+        'sender': item.sender,
+        'subject': item.subject,
+        'date': item.date,
+        'snippet': item.snippet,
+        'status': item.status.value,
+        'priority': item.priority or classifier.PRIORITY_NORMAL,
+        'score': item.score,
+        'received_at': item.received_at.isoformat() if item.received_at else None,
+        'created_at': item.created_at.isoformat() if item.created_at else None,
+    }
 
-    connected_gmails = gmail_mgr.list_connected_accounts()
+def _cached_view(render, *extra):
+    """Serve render() from item_views with a weak ETag; 304 when If-None-Match matches.
 
-    service_account = CFG.get('SERVICE_GOOGLE_ACCOUNT') or ''
-    # Drive connection = token exists/loads
+    The key is the endpoint, its query args (status, q, cursor, limit) and
+    anything else the page shows (extra).
+    """
+    if '_flashes' in session:
+        return render()
+    key = (request.endpoint, tuple(sorted(request.args.items(multi=True))), extra)
+    version = item_views.version()
+    etag = item_views.etag(key, version)
+    if request.if_none_match.contains_weak(etag):
+        resp = app.response_class(status=304)
+    else:
+        cached = item_views.get(key, version)
+        if cached is None:
+            rendered = app.make_response(render())
+            cached = (rendered.get_data(), rendered.mimetype)
+            item_views.put(key, version, cached)
+        resp = app.response_class(cached[0], mimetype=cached[1])
+    resp.set_etag(etag, weak=True)
+    resp.headers['Cache-Control'] = 'private, no-cache'
+    return resp
+
+@app.route('/api/items')
+def api_items():
+    def render():
+        items, next_cursor, prev_cursor = _list_items(request.args)
+        return jsonify({'items': [_item_json(i) for i in items], 'next': next_cursor, 'prev': prev_cursor})
+    return _cached_view(render)
+
+@app.route('/api/stats')
+def api_stats():
+    """Item counts by status, by account and per received day (?days=1..366, default 14)."""
+    days = request.args.get('days', rollups.STATS_DAYS, type=int)
+    if not 1 <= days <= 366:
+        return jsonify({'ok': False, 'error': 'days must be between 1 and 366'}), 400
+
+    def render():
+        stats = rollups.stats(Session(), days=days)
+        return jsonify(dict(stats, trend=rollups.trend(stats)))
+    return _cached_view(render)
+
+@app.route('/export')
+def export_items():
+    """Stream items joined with their photos as CSV (default) or NDJSON.
+
+    Filters: status, from and to (ISO dates on received_at; a bare `to` date is inclusive).
+    """
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify({'ok': False, 'error': 'format must be csv or ndjson'}), 400
+    status = request.args.get('status') or None
+    if status and status not in STATUSES:
+        return jsonify({'ok': False, 'error': 'Bad status'}), 400
     try:
-        has_drive = bool(service_account and drive_mgr.load_credentials(service_account))
-    except Exception:
-        has_drive = False
+        start = export.parse_date(request.args.get('from'))
+        end = export.parse_date(request.args.get('to'), end=True)
+    except ValueError:
+        return jsonify({'ok': False, 'error': 'from/to must be ISO dates'}), 400
+
+    def generate():
+        session_db = SessionFactory()
+        try:
+            rows = export.export_rows(session_db, status=status, start=start, end=end)
+            yield from (export.iter_csv(rows) if fmt == 'csv' else export.iter_ndjson(rows))
+        finally:
+            session_db.close()
+
+    filename = f"damage-items-{datetime.utcnow():%Y%m%d}.{fmt}"
+    return Response(stream_with_context(generate()),
+                    mimetype='text/csv' if fmt == 'csv' else 'application/x-ndjson',
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+@app.route('/')
+def index():
+    badge = connection_badge.get()
+    return _cached_view(lambda: _render_index(*badge), badge)
+
+def _render_index(connected_gmails, has_drive):
+    status = request.args.get('status')
+    kw = request.args.get('q', '').strip()
+    items, next_cursor, prev_cursor = _list_items(
+        request.args, load_only(*LIST_COLUMNS), selectinload(EmailItem.photos).load_only(Photo.id))
+    service_account = CFG.get('SERVICE_GOOGLE_ACCOUNT') or ''
+    stats = rollups.stats(Session())
 
     return render_template(
         'index.html',
         items=items,
         kw=kw,
         status=status,
+        priority=request.args.get('priority'),
+        next_cursor=next_cursor,
+        prev_cursor=prev_cursor,
         monitored=[a.strip() for a in CFG['MONITORED_GMAIL_ACCOUNTS'].split(',') if a.strip()],
         connected_gmails=connected_gmails,
         drive_connected=has_drive,
         service_account=service_account,
+        stats=stats,
+        trend=rollups.trend(stats),
         config=CFG
     )
 
+@app.route('/photo/<int:photo_id>/thumb')
+def photo_thumb(photo_id):
+    """Downscaled photo (?size=sm|md|lg), served by the app so browsers never fetch full-size Drive files."""
+    size = request.args.get('size', thumbnails.DEFAULT_SIZE)
+    if size not in thumbnails.SIZES:
+        abort(400)
+    session_db = Session()
+    photo = session_db.get(Photo, photo_id)
+    if photo is None or thumbnails.source_key(photo) is None:
+        abort(404)
+    # The source key is a content hash or Drive file id, so a thumbnail never changes
+    etag = f'{thumbnails.source_key(photo)}-{size}'
+    if request.if_none_match.contains(etag):
+        resp = app.response_class(status=304)
+    else:
+        try:
+            data = thumbnails.get_thumbnail(session_db, drive_mgr, CFG['SERVICE_GOOGLE_ACCOUNT'], photo, size,
+                                            thumbnail_cache)
+        except Exception as e:
+            session_db.rollback()
+            print('Thumbnail error:', e)
+            if photo.web_content_link:
+                return redirect(photo.web_content_link)
+            abort(404)
+        resp = app.response_class(data, mimetype=thumbnails.MIME_TYPE)
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return resp
+
 @app.route('/detail/<int:item_id>')
 def detail(item_id):
     session_db = Session()
-    item = session_db.get(EmailItem, item_id)
+    item = session_db.get(EmailItem, item_id,
+                          options=[joinedload(EmailItem.photos), selectinload(EmailItem.messages)])
     if not item:
         flash('Item not found', 'warning')
         return redirect(url_for('index'))
@@ -105,12 +304,71 @@ def update_status(item_id, new_status):
     item = session_db.get(EmailItem, item_id)
     if not item:
         return jsonify({'ok': False, 'error': 'Not found'}), 404
-    if new_status not in {'NEW', 'RESOLVED', 'CREDIT_RECEIVED'}:
+    if new_status not in STATUSES:
         return jsonify({'ok': False, 'error': 'Bad status'}), 400
+    if item.status != Status[new_status]:
+        rollups.add(session_db, rollups.moved(item, item.status, Status[new_status]))
     item.status = Status[new_status]
+    bump_version(session_db)
     session_db.commit()
+    item_views.expire()
     return jsonify({'ok': True, 'status': new_status})
 
+@app.route('/status/bulk', methods=['POST'])
+def bulk_update_status():
+    """Set one status on many items in a single transaction.
+
+    JSON body: {"status": "RESOLVED", "ids": [1, 2, ...]} or
+    {"status": "RESOLVED", "filter": {"status": "NEW", "q": "credit"}}.
+    Returns {"results": {id: "updated" | "unchanged" | "not_found"}}.
+    """
+    data = request.get_json(silent=True) or {}
+    new_status = data.get('status')
+    if new_status not in STATUSES:
+        return jsonify({'ok': False, 'error': 'Bad status'}), 400
+
+    session_db = Session()
+    if 'ids' in data:
+        ids = data['ids']
+        # int() would accept "12" (iterated as 1, 2), true and 1.5; only JSON integers are ids
+        if not isinstance(ids, list) or any(type(i) is not int for i in ids):
+            return jsonify({'ok': False, 'error': 'ids must be a list of integers'}), 400
+        ids = list(dict.fromkeys(ids))
+    elif isinstance(data.get('filter'), dict):
+        flt = {k: str(v) for k, v in data['filter'].items() if k in ('status', 'priority', 'q') and v}
+        if not flt:
+            return jsonify({'ok': False, 'error': 'Empty filter'}), 400
+        ids = [r[0] for r in _filter_items(session_db.query(EmailItem.id), flt).limit(BULK_STATUS_MAX + 1)]
+    else:
+        return jsonify({'ok': False, 'error': 'Pass ids or filter'}), 400
+    if len(ids) > BULK_STATUS_MAX:
+        return jsonify({'ok': False, 'error': f'At most {BULK_STATUS_MAX} items per request'}), 400
+
+    target = Status[new_status]
+    results = {}
+    if ids:
+        existing = {r.id: r for r in session_db.query(EmailItem.id, EmailItem.status, EmailItem.account_email,
+                                                      EmailItem.received_at, EmailItem.created_at)
+                    .filter(EmailItem.id.in_(ids)).with_for_update()}
+        changed = {r[0] for r in session_db.execute(
+            update(EmailItem)
+            .where(EmailItem.id.in_(ids), EmailItem.status != target)
+            .values(status=target)
+            .returning(EmailItem.id)
+            .execution_options(synchronize_session=False))}
+        for i in ids:
+            results[i] = 'updated' if i in changed else 'unchanged' if i in existing else 'not_found'
+        if changed:
+            deltas = Counter()
+            for i in changed:
+                deltas.update(rollups.moved(existing[i], existing[i].status, target))
+            rollups.add(session_db, deltas)
+            bump_version(session_db)
+        session_db.commit()
+        item_views.expire()
+    return jsonify({'ok': True, 'status': new_status, 'updated': sum(v == 'updated' for v in results.values()),
+                    'results': results})
+
 # ---- Gmail OAuth ----
 @app.route('/connect/gmail')
 def connect_gmail():
@@ -153,49 +411,114 @@ def oauth2callback_drive():
 
     try:
         drive_mgr.finish_authorize(email, authorization_response_url, redirect_uri, state=state)
+        connection_badge.clear()
         flash("Google Drive connected.", "success")
         return redirect(url_for("index"))
     except Exception as e:
         app.logger.exception("OAuth callback (Drive) failed")
         return f"Callback failed: {e}", 500
 
+# ---- Background jobs ----
+def _scan_job():
+    results = scan_gmail_accounts(SessionFactory, gmail_mgr, drive_mgr, CFG)
+    item_views.expire()
+    return {
+        'ok': all(r['ok'] for r in results.values()),
+        'updated': sum(r['updated'] for r in results.values()),
+        'accounts': results,
+    }
+
+def _backfill_job():
+    session_db = SessionFactory()
+    try:
+        return backfill_received_at(session_db)
+    finally:
+        session_db.close()
+        item_views.expire()
+
+def _session_job(fn):
+    def job():
+        session_db = SessionFactory()
+        try:
+            return fn(session_db, gmail_mgr, CFG)
+        finally:
+            session_db.close()
+    return job
+
+scheduler = JobScheduler(engine, SessionFactory,
+                         retention=timedelta(days=CFG['JOB_RUNS_RETENTION_DAYS']) if CFG['JOB_RUNS_RETENTION_DAYS'] else None)
+scheduler.register('scan', _scan_job, timedelta(minutes=CFG['SCAN_INTERVAL_MINUTES']) / 2,
+                   'interval', minutes=CFG['SCAN_INTERVAL_MINUTES'])
+scheduler.register('drain-outbox', _session_job(drain_outbox), None, 'interval', minutes=1)
+scheduler.register('daily-summary', _session_job(send_daily_summary), timedelta(hours=12),
+                   'cron', hour=CFG['DAILY_SUMMARY_HOUR'])
+# Runs once at startup, then hourly as a cheap no-op once every row has received_at
+scheduler.register('backfill-received-at', _backfill_job, None,
+                   'interval', hours=1, next_run_time=datetime.utcnow())
+
+def start_scheduler():
+    """Start the background jobs; called by the gunicorn worker hook (gunicorn.conf.py) and
+    `python app.py`. Not at import, so `flask --app app migrate` cannot race its own schema changes."""
+    if CFG['SCHEDULER_ENABLED']:
+        scheduler.start()
+
 # ---- Tasks (cron/webhook endpoints) ----
-@app.route('/tasks/scan')
-def task_scan():
+def _trigger(job_name):
+    """Queue a job on the background scheduler, or run it inline when the scheduler is disabled."""
     secret = request.args.get('secret')
     if secret != CFG['TASKS_SECRET']:
         return jsonify({'ok': False, 'error': 'Unauthorized'}), 401
 
-    session_db = Session()
-    try:
-        count = scan_gmail_accounts(session_db, gmail_mgr, drive_mgr, CFG)
-        session_db.commit()
-        return jsonify({'ok': True, 'updated': count})
-    except Exception as e:
-        session_db.rollback()
-        return jsonify({'ok': False, 'error': str(e)}), 500
-    finally:
-        session_db.close()
+    if scheduler.running:
+        scheduler.enqueue(job_name)
+        return jsonify({'ok': True, 'queued': job_name}), 202
+    run_id = scheduler.run(job_name)
+    if run_id is None:
+        return jsonify({'ok': False, 'error': f'{job_name} is already running'}), 409
+    run = scheduler.get_run(run_id)
+    return jsonify({'ok': bool(run['ok']), 'run': run}), (200 if run['ok'] else 500)
+
+@app.route('/tasks/scan')
+def task_scan():
+    return _trigger('scan')
 
 @app.route('/tasks/daily-summary')
 def task_daily_summary():
+    return _trigger('daily-summary')
+
+@app.route('/tasks/drain-outbox')
+def task_drain_outbox():
+    return _trigger('drain-outbox')
+
+@app.route('/tasks/backfill-received-at')
+def task_backfill_received_at():
+    return _trigger('backfill-received-at')
+
+@app.route('/tasks/runs')
+def task_runs():
     secret = request.args.get('secret')
     if secret != CFG['TASKS_SECRET']:
         return jsonify({'ok': False, 'error': 'Unauthorized'}), 401
+    return jsonify({'ok': True, 'runs': scheduler.recent_runs(request.args.get('limit', 50, type=int))})
 
-    session_db = Session()
-    try:
-        sent = send_daily_summary(session_db, gmail_mgr, CFG)
-        return jsonify({'ok': True, 'sent': sent})
-    except Exception as e:
-        return jsonify({'ok': False, 'error': str(e)}), 500
-    finally:
-        session_db.close()
+@app.cli.command('migrate')
+def migrate_command():
+    """Create or upgrade the database schema."""
+    migrate(engine)
 
 # Simple health check for Render
 @app.route('/healthz')
 def healthz():
     return jsonify({'ok': True})
 
+# Prometheus scrape endpoint; labels include account emails, so it is behind TASKS_SECRET
+# (set params: {secret: [...]} in the scrape config)
+@app.route('/metrics')
+def metrics():
+    if request.args.get('secret') != CFG['TASKS_SECRET']:
+        return jsonify({'ok': False, 'error': 'Unauthorized'}), 401
+    return METRICS.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
 if __name__ == '__main__':
+    start_scheduler()
     app.run(debug=False)
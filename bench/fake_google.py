@@ -0,0 +1,214 @@
+"""Local stand-in for the Gmail and Drive HTTP APIs used by the scan benchmark.
+
+FakeGoogleHttp implements the httplib2.Http.request interface, so real
+googleapiclient services (including batch requests and resumable uploads)
+can be built on top of it with build(..., http=FakeGoogleHttp(...)).
+"""
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from email.parser import BytesParser
+from urllib.parse import parse_qs, urlparse
+
+import httplib2
+
+class FakeGoogleBackend:
+    """Synthetic mailboxes plus a Drive sink, shared by every FakeGoogleHttp."""
+    def __init__(self, accounts, messages_per_account, attachments_per_message=2, attachment_bytes=20_000,
+                 dup_rate=0.2, latency_ms=20.0, batch_item_ms=1.0, error_rate=0.0, thread_length=1, noise_rate=0.0,
+                 seed=0):
+        self.accounts = list(accounts)
+        self.messages_per_account = messages_per_account
+        self.attachments_per_message = attachments_per_message
+        self.attachment_bytes = attachment_bytes
+        self.dup_rate = dup_rate
+        self.thread_length = max(1, thread_length)  # consecutive messages per thread
+        self.noise_rate = noise_rate  # share of keyword matches that are newsletters, not damage reports
+        self.latency = latency_ms / 1000.0
+        self.batch_item_latency = batch_item_ms / 1000.0
+        self.error_rate = error_rate
+        self.history_id = 1000
+        self.calls = Counter()
+        self.round_trips = 0
+        self.injected_errors = 0
+        self._uploads = {}
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._dup_pool = [self._bytes(f'dup-{i}') for i in range(8)]
+
+    def _bytes(self, key):
+        block = hashlib.sha256(key.encode()).digest()
+        return (block * (self.attachment_bytes // len(block) + 1))[:self.attachment_bytes]
+
+    def _message_ids(self, account):
+        idx = self.accounts.index(account)
+        return [f'{idx:02d}{i:07d}' for i in range(self.messages_per_account)]
+
+    def _thread_id(self, msg_id):
+        n = int(msg_id[2:])
+        return f't{msg_id[:2]}{n - n % self.thread_length:07d}'
+
+    def _thread_message_ids(self, thread_id):
+        prefix, first = thread_id[1:3], int(thread_id[3:])
+        last = min(first + self.thread_length, self.messages_per_account)
+        return [f'{prefix}{i:07d}' for i in range(first, last)]
+
+    def _fail(self):
+        if not self.error_rate:
+            return False
+        with self._lock:
+            failed = self._random.random() < self.error_rate
+            self.injected_errors += failed
+            return failed
+
+    def _attachment(self, msg_id, att_id):
+        key = f'{msg_id}:{att_id}'
+        if self.dup_rate and int(hashlib.md5(key.encode()).hexdigest(), 16) % 1000 < self.dup_rate * 1000:
+            return self._dup_pool[int(msg_id) % len(self._dup_pool)]
+        return self._bytes(key)
+
+    def _is_noise(self, msg_id):
+        # Decided per thread: a newsletter thread has no damage reports in it
+        key = self._thread_id(msg_id).encode()
+        return bool(self.noise_rate) and int(hashlib.md5(key).hexdigest(), 16) % 1000 < self.noise_rate * 1000
+
+    def _message(self, msg_id):
+        parts = [{'partId': '0', 'mimeType': 'text/plain', 'filename': '', 'body': {'size': 120}}]
+        for i in range(self.attachments_per_message):
+            parts.append({'partId': str(i + 1), 'mimeType': 'image/jpeg', 'filename': f'photo_{i}.jpg',
+                          'body': {'attachmentId': f'att{i}', 'size': self.attachment_bytes}})
+        headers = [
+            {'name': 'From', 'value': f'customer{msg_id}@example.com'},
+            {'name': 'Subject', 'value': f'Damage claim {msg_id}'},
+            {'name': 'Date', 'value': 'Tue, 14 Nov 2023 22:13:20 +0000'},
+        ]
+        snippet = 'The sofa arrived with damage to the left arm, requesting a replacement.'
+        if self._is_noise(msg_id):
+            # A keyword match that is not a damage report: bulk mail with image banners
+            headers = [
+                {'name': 'From', 'value': 'Bank News <news@bank.example>'},
+                {'name': 'Subject', 'value': 'Your credit card statement and 20% off deals'},
+                {'name': 'Date', 'value': 'Tue, 14 Nov 2023 22:13:20 +0000'},
+                {'name': 'List-Unsubscribe', 'value': '<mailto:unsubscribe@bank.example>'},
+            ]
+            snippet = 'Your monthly credit card statement is ready. Unsubscribe at any time.'
+        return {
+            'id': msg_id, 'threadId': self._thread_id(msg_id), 'historyId': str(self.history_id),
+            'internalDate': str(1700000000000 + int(msg_id) * 1000),
+            'snippet': snippet,
+            'payload': {
+                'mimeType': 'multipart/mixed', 'partId': '',
+                'headers': headers,
+                'parts': parts,
+            },
+        }
+
+    def handle(self, account, method, uri, body, headers):
+        """Return (status, headers, body_bytes) for one (non-batch) API request."""
+        url = urlparse(uri)
+        path, query = url.path, parse_qs(url.query)
+        if self._fail():
+            return 503, {}, json.dumps({'error': {'code': 503, 'message': 'Backend Error'}}).encode()
+
+        def ok(obj, status=200, extra=None):
+            return status, dict(extra or {}), json.dumps(obj).encode()
+
+        if path.endswith('/users/me/profile'):
+            self.calls['gmail.getProfile'] += 1
+            return ok({'emailAddress': account, 'historyId': str(self.history_id)})
+        if path.endswith('/users/me/history'):
+            self.calls['gmail.history.list'] += 1
+            return ok({'historyId': str(self.history_id)})
+        if path.endswith('/users/me/messages/send'):
+            self.calls['gmail.messages.send'] += 1
+            return ok({'id': 'sent'})
+        m = re.search(r'/users/me/messages/([^/]+)/attachments/([^/]+)$', path)
+        if m:
+            self.calls['gmail.attachments.get'] += 1
+            data = self._attachment(m.group(1), m.group(2))
+            return ok({'size': len(data), 'data': base64.urlsafe_b64encode(data).decode()})
+        m = re.search(r'/users/me/messages/([^/]+)$', path)
+        if m:
+            self.calls['gmail.messages.get'] += 1
+            return ok(self._message(m.group(1)))
+        m = re.search(r'/users/me/threads/([^/]+)$', path)
+        if m:
+            self.calls['gmail.threads.get'] += 1
+            return ok({'id': m.group(1), 'historyId': str(self.history_id),
+                       'messages': [self._message(i) for i in self._thread_message_ids(m.group(1))]})
+        if path.endswith('/users/me/messages'):
+            self.calls['gmail.messages.list'] += 1
+            ids = self._message_ids(account)
+            start = int(query.get('pageToken', ['0'])[0])
+            size = int(query.get('maxResults', ['100'])[0])
+            page = ids[start:start + size]
+            resp = {'messages': [{'id': i, 'threadId': self._thread_id(i)} for i in page], 'resultSizeEstimate': len(ids)}
+            if start + size < len(ids):
+                resp['nextPageToken'] = str(start + size)
+            return ok(resp)
+        if path.startswith('/upload/drive/v3/files') and method == 'POST':
+            self.calls['drive.files.create'] += 1
+            with self._lock:
+                upload_id = str(len(self._uploads) + 1)
+                self._uploads[upload_id] = 0
+            return ok({}, extra={'location': f'https://fake.googleapis.com/upload/session/{upload_id}'})
+        m = re.search(r'/upload/session/(\d+)$', path)
+        if m:
+            self.calls['drive.upload.chunk'] += 1
+            rng = re.match(r'bytes (\d+)-(\d+)/(\d+|\*)', (headers or {}).get('Content-Range', '') or
+                           (headers or {}).get('content-range', ''))
+            if rng and rng.group(3) != '*' and int(rng.group(2)) + 1 < int(rng.group(3)):
+                return 308, {'range': f'bytes=0-{rng.group(2)}'}, b''
+            fid = f'drive{m.group(1)}'
+            return ok({'id': fid, 'webViewLink': f'https://drive.example/{fid}/view',
+                       'webContentLink': f'https://drive.example/{fid}/content'})
+        return 404, {}, json.dumps({'error': {'code': 404, 'message': f'No fake for {method} {path}'}}).encode()
+
+    def batch(self, account, content_type, body):
+        parser = BytesParser()
+        envelope = parser.parsebytes(f'Content-Type: {content_type}\r\n\r\n'.encode() + body)
+        out = []
+        boundary = 'fake_batch_boundary'
+        for part in envelope.get_payload():
+            raw = part.get_payload(decode=False)
+            raw = raw.encode() if isinstance(raw, str) else raw
+            head, _, sub_body = raw.replace(b'\r\n', b'\n').partition(b'\n\n')
+            lines = head.decode().split('\n')
+            method, path, _ = lines[0].split(' ', 2)
+            sub_headers = dict(line.split(': ', 1) for line in lines[1:] if ': ' in line)
+            time.sleep(self.batch_item_latency)
+            status, extra, payload = self.handle(account, method, 'https://fake.googleapis.com' + path,
+                                                 sub_body, sub_headers)
+            out.append(
+                f'--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <response-{part["Content-ID"][1:-1]}>\r\n\r\n'
+                f'HTTP/1.1 {status} {"OK" if status == 200 else "Error"}\r\nContent-Type: application/json\r\n\r\n'
+                .encode() + payload + b'\r\n')
+        return b''.join(out) + f'--{boundary}--'.encode(), f'multipart/mixed; boundary="{boundary}"'
+
+class FakeGoogleHttp:
+    """httplib2.Http stand-in bound to one account of a FakeGoogleBackend."""
+    def __init__(self, backend, account):
+        self.backend = backend
+        self.account = account
+
+    def request(self, uri, method='GET', body=None, headers=None, redirections=5, connection_type=None):
+        backend = self.backend
+        with backend._lock:
+            backend.round_trips += 1
+        time.sleep(backend.latency)
+        if body is not None and isinstance(body, str):
+            body = body.encode()
+        if urlparse(uri).path.startswith('/batch'):
+            content, ctype = backend.batch(self.account, headers['content-type'], body)
+            return httplib2.Response({'status': '200', 'content-type': ctype}), content
+        if body is not None and hasattr(body, 'read'):
+            body = body.read()
+        status, extra, content = backend.handle(self.account, method, uri, body, headers)
+        resp_headers = {'status': str(status), 'content-type': 'application/json'}
+        resp_headers.update(extra)
+        return httplib2.Response(resp_headers), content
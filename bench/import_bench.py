@@ -0,0 +1,115 @@
+"""Cold-start benchmark: import time of app.py and latency of the first requests.
+
+Each run is a fresh interpreter under `python -X importtime`, against a
+throwaway SQLite database with the scheduler disabled. Reports the median
+import time, the slowest top-level imports, whether any Google client
+library was loaded, and the first /healthz and / latencies:
+
+    python bench/import_bench.py --runs 5 --output import_bench.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GOOGLE_PREFIXES = ('google.', 'googleapiclient', 'google_auth_oauthlib', 'google_auth_httplib2', 'httplib2', 'oauthlib')
+
+def child():
+    sys.path.insert(0, ROOT)
+    t0 = time.perf_counter()
+    import app
+    imported = time.perf_counter() - t0
+    client = app.app.test_client()
+    t1 = time.perf_counter()
+    client.get('/healthz')
+    healthz = time.perf_counter() - t1
+    t2 = time.perf_counter()
+    client.get('/')
+    dashboard = time.perf_counter() - t2
+    json.dump({
+        'import_ms': round(imported * 1000, 1),
+        'first_healthz_ms': round(healthz * 1000, 1),
+        'first_dashboard_ms': round(dashboard * 1000, 1),
+        'google_modules': sorted(m for m in sys.modules if m.startswith(GOOGLE_PREFIXES)),
+    }, sys.stdout)
+
+def parse_importtime(stderr):
+    """Return {module: cumulative ms} for the modules app.py imports directly.
+
+    -X importtime prints children before their parent, indented two spaces per
+    level; app is the top-level import of interest, so its own imports sit one level below.
+    """
+    pending = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            pending[name.strip()] = int(cumulative) / 1000
+        elif depth == 0:
+            if name.strip() == 'app':
+                return pending
+            pending = {}
+    return pending
+
+def run_once(db_dir):
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{db_dir}/bench.db', SCHEDULER_ENABLED='0')
+    proc = subprocess.run([sys.executable, '-X', 'importtime', os.path.abspath(__file__), '--child'],
+                          capture_output=True, text=True, cwd=db_dir, env=env)
+    if proc.returncode:
+        sys.stderr.write(proc.stderr[-4000:])
+        raise SystemExit('child run failed')
+    result = json.loads(proc.stdout)
+    result['top_imports_ms'] = parse_importtime(proc.stderr)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15, help='slowest top-level imports to report')
+    parser.add_argument('--output', default='import_bench.json')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child()
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        subprocess.run([sys.executable, os.path.join(ROOT, 'migrations.py')], check=True, cwd=tmp,
+                       env=dict(os.environ, DATABASE_URL=f'sqlite:///{tmp}/bench.db'), capture_output=True)
+        runs = [run_once(tmp) for _ in range(args.runs)]
+
+    def median(key):
+        return round(statistics.median(r[key] for r in runs), 1)
+
+    modules = {}
+    for r in runs:
+        for name, ms in r['top_imports_ms'].items():
+            modules.setdefault(name, []).append(ms)
+    slowest = sorted(((round(statistics.median(v), 1), k) for k, v in modules.items()), reverse=True)[:args.top]
+    commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, cwd=ROOT)
+    report = {
+        'commit': commit.stdout.strip() or None,
+        'python': sys.version.split()[0],
+        'runs': args.runs,
+        'import_ms': median('import_ms'),
+        'first_healthz_ms': median('first_healthz_ms'),
+        'first_dashboard_ms': median('first_dashboard_ms'),
+        'google_modules_loaded': runs[0]['google_modules'],
+        'slowest_imports_ms': {k: ms for ms, k in slowest},
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"import app: {report['import_ms']} ms, first /healthz {report['first_healthz_ms']} ms, "
+          f"first / {report['first_dashboard_ms']} ms, Google modules loaded: {len(report['google_modules_loaded'])}",
+          file=sys.stderr)
+    print(f'Wrote {args.output}', file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
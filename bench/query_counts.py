@@ -0,0 +1,98 @@
+"""Pin the dashboard, API, detail page and daily summary to a fixed number of SQL queries.
+
+Seeds a throwaway SQLite database at two sizes (items with photos and thread
+messages), runs every path under metrics.assert_max_queries and fails if a
+path exceeds its budget or issues more queries for more rows (an N+1):
+
+    python bench/query_counts.py --sizes 5 200
+"""
+import argparse
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Maximum statements per path. Dashboard and API: cache version, the page and
+# (dashboard) photo ids plus two rollup reads; detail: item with photos and its
+# thread messages; daily summary: items, photo ids and two rollup reads.
+BUDGETS = {'dashboard': 5, 'api_items': 2, 'api_stats': 3, 'detail': 2, 'daily_summary': 4}
+
+def seed(session, n_items, photos=3, messages=2):
+    import rollups
+    from models import EmailItem, EmailMessage, Photo, Status
+
+    now = datetime.utcnow()
+    for i in range(n_items):
+        item = EmailItem(gmail_message_id=f'm{i}', thread_id=f't{i}', account_email='inbox@example.com',
+                         sender=f'customer{i}@example.com', subject=f'Damage claim {i}', date='',
+                         snippet='The sofa arrived damaged. ' * 20, status=Status.NEW,
+                         received_at=now - timedelta(minutes=i))
+        item.photos = [Photo(filename=f'photo_{j}.jpg', drive_file_id=f'd{i}-{j}', content_hash=f'{i}-{j}')
+                       for j in range(photos)]
+        item.messages = [EmailMessage(gmail_message_id=f'm{i}-{j}', received_at=now) for j in range(messages)]
+        session.add(item)
+    session.flush()
+    rollups.rebuild(session)
+    session.commit()
+
+def measure(app, tasks, assert_max_queries):
+    client = app.app.test_client()
+    app.connection_badge.get()  # cached for DASHBOARD_BADGE_TTL; not part of the page cost
+    counts = {}
+
+    def run(name, fn):
+        app.item_views.clear()
+        with assert_max_queries(app.engine, BUDGETS[name]) as statements:
+            fn()
+        counts[name] = len(statements)
+
+    first_id = app.SessionFactory().query(app.EmailItem.id).order_by(app.EmailItem.id).limit(1).scalar()
+    run('dashboard', lambda: client.get('/'))
+    run('api_items', lambda: client.get('/api/items?limit=200'))
+    run('api_stats', lambda: client.get('/api/stats?days=30'))
+    run('detail', lambda: client.get(f'/detail/{first_id}'))
+
+    def summary():
+        session = app.SessionFactory()
+        try:
+            stats = tasks.rollups.stats(session, days=8)
+            tasks.build_daily_summary_html(tasks.daily_summary_items(session), stats, tasks.rollups.trend(stats))
+        finally:
+            session.close()
+    run('daily_summary', summary)
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[5, 200])
+    args = parser.parse_args()
+
+    results = {}
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            os.environ.update(DATABASE_URL=f'sqlite:///{tmp}/bench.db', SCHEDULER_ENABLED='0')
+            sys.path.insert(0, ROOT)
+            for mod in [m for m in sys.modules if m in ('app', 'config')]:
+                del sys.modules[mod]
+            import app
+            import tasks
+            from metrics import assert_max_queries
+            from migrations import migrate
+
+            migrate(app.engine)
+            session = app.SessionFactory()
+            seed(session, size)
+            session.close()
+            results[size] = measure(app, tasks, assert_max_queries)
+            app.Session.remove()
+            app.engine.dispose()
+        print(f'{size:>5} items: ' + ', '.join(f'{k} {v}' for k, v in results[size].items()), file=sys.stderr)
+
+    growing = [k for k in BUDGETS if len({r[k] for r in results.values()}) > 1]
+    if growing:
+        raise SystemExit(f'query count depends on row count for: {", ".join(growing)}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+"""Offline benchmark for tasks.scan_gmail_accounts.
+
+Runs the real scan, ingest and outbox code against bench/fake_google.py and a
+throwaway SQLite database, one subprocess per workload so peak RSS is
+per-workload. Writes machine-readable JSON for comparing commits:
+
+    python bench/scan_bench.py --sizes 100 1000 10000 --accounts 4 --output bench_results.json
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+class StageTimer:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - t0) * 1000
+            with self._lock:
+                self.samples[name].append(elapsed)
+
+    def summary(self):
+        out = {}
+        for name, values in sorted(self.samples.items()):
+            values = sorted(values)
+            out[name] = {
+                'count': len(values),
+                'p50_ms': round(statistics.median(values), 3),
+                'p99_ms': round(values[min(len(values) - 1, int(len(values) * 0.99))], 3),
+                'total_ms': round(sum(values), 1),
+            }
+        return out
+
+def _managers(backend, timer, token_dir):
+    from googleapiclient.discovery import build
+    from drive_client import DriveManager
+    from fake_google import FakeGoogleHttp
+    from gmail_client import GmailManager
+
+    local = threading.local()
+
+    def service(api, version, account):
+        # One client per thread and account, like service_cache.build_service
+        cache = local.__dict__.setdefault('services', {})
+        key = (api, account)
+        if key not in cache:
+            cache[key] = build(api, version, http=FakeGoogleHttp(backend, account), static_discovery=True)
+        return cache[key]
+
+    class BenchGmail(GmailManager):
+        def _service(self, email):
+            return service('gmail', 'v1', email)
+
+        def search_messages(self, *a, **kw):
+            with timer.stage('search'):
+                return super().search_messages(*a, **kw)
+
+        def list_history(self, *a, **kw):
+            with timer.stage('search'):
+                return super().list_history(*a, **kw)
+
+        def get_messages(self, *a, **kw):
+            with timer.stage('metadata_fetch'):
+                return super().get_messages(*a, **kw)
+
+        def get_threads(self, *a, **kw):
+            with timer.stage('metadata_fetch'):
+                return super().get_threads(*a, **kw)
+
+        def download_attachments(self, *a, **kw):
+            with timer.stage('attachment_download'):
+                return super().download_attachments(*a, **kw)
+
+        def send_email(self, *a, **kw):
+            with timer.stage('notification_send'):
+                return super().send_email(*a, **kw)
+
+    class BenchDrive(DriveManager):
+        def _service(self, email):
+            return service('drive', 'v3', email)
+
+        def upload_photo(self, *a, **kw):
+            with timer.stage('drive_upload'):
+                return super().upload_photo(*a, **kw)
+
+    gmail = BenchGmail(None, None, [])
+    drive = BenchDrive(os.path.join(ROOT, 'client_secret.json'), token_dir=token_dir, upload_workers=4)
+    return gmail, drive
+
+def run_workload(args):
+    from sqlalchemy import create_engine, event
+    from sqlalchemy.orm import sessionmaker
+
+    import tasks
+    from fake_google import FakeGoogleBackend
+    from google_api import EXECUTOR
+    from migrations import migrate
+    from models import Notification, OutboxStatus
+
+    accounts = [f'inbox{i}@example.com' for i in range(args.accounts)]
+    per_account = -(-args.messages // args.accounts)
+    backend = FakeGoogleBackend(accounts, per_account, attachments_per_message=args.attachments,
+                                attachment_bytes=args.attachment_bytes, dup_rate=args.dup_rate,
+                                latency_ms=args.latency_ms, error_rate=args.error_rate,
+                                thread_length=args.thread_length, noise_rate=args.noise_rate)
+    EXECUTOR.configure(rates={'gmail': args.quota, 'drive': args.quota})
+    EXECUTOR.base_delay = 0.05
+    timer = StageTimer()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # One connection per scanning inbox plus one per message worker, as in app.py
+        engine = create_engine(f'sqlite:///{tmp}/bench.db', future=True, connect_args={'timeout': 30},
+                               pool_size=args.account_workers * (args.message_workers + 1) + 1)
+        migrate(engine)
+        db = {'queries': 0}
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def _before(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault('bench_t0', []).append(time.perf_counter())
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def _after(conn, cursor, statement, parameters, context, executemany):
+            t0 = conn.info['bench_t0'].pop()
+            db['queries'] += 1
+            with timer._lock:
+                timer.samples['db_statement'].append((time.perf_counter() - t0) * 1000)
+
+        SessionFactory = sessionmaker(bind=engine, autoflush=False)
+        gmail, drive = _managers(backend, timer, tmp)
+        CFG = {
+            'MONITORED_GMAIL_ACCOUNTS': ','.join(accounts),
+            'SERVICE_GOOGLE_ACCOUNT': 'sender@example.com',
+            'NOTIFY_EMAILS': 'staff@example.com,ops@example.com',
+            'NOTIFY_DIGEST': args.digest,
+            'SCAN_MAX_RESULTS': per_account,
+            'SCAN_ACCOUNT_WORKERS': args.account_workers,
+            'SCAN_MESSAGE_WORKERS': args.message_workers,
+            'SCAN_THREAD_MODE': args.thread_mode,
+            'CLASSIFIER_ENABLED': not args.no_classifier,
+        }
+
+        t0 = time.perf_counter()
+        results = tasks.scan_gmail_accounts(SessionFactory, gmail, drive, CFG)
+        scan_s = time.perf_counter() - t0
+        scan_calls = sum(backend.calls.values())
+        scan_queries = db['queries']
+
+        t1 = time.perf_counter()
+        session = SessionFactory()
+        while session.query(Notification.id).filter(Notification.status == OutboxStatus.PENDING).first():
+            drained = tasks.drain_outbox(session, gmail, CFG)
+            if not drained['sent'] and not drained['failed']:
+                break
+        session.close()
+        drain_s = time.perf_counter() - t1
+
+        calls_before, queries_before = sum(backend.calls.values()), db['queries']
+        t2 = time.perf_counter()
+        tasks.scan_gmail_accounts(SessionFactory, gmail, drive, CFG)
+        rescan_s = time.perf_counter() - t2
+
+    ingested = sum(r['updated'] for r in results.values())
+    return {
+        'messages': args.messages,
+        'accounts': args.accounts,
+        'ingested': ingested,
+        'low_priority': sum(r.get('low_priority', 0) for r in results.values()),
+        'scan_errors': {a: r.get('error') for a, r in results.items() if not r['ok']},
+        'scan_seconds': round(scan_s, 3),
+        'messages_per_sec': round(ingested / scan_s, 2) if scan_s else None,
+        'api_calls': dict(backend.calls),
+        'api_calls_per_message': round(scan_calls / max(ingested, 1), 3),
+        'http_round_trips': backend.round_trips,
+        'injected_errors': backend.injected_errors,
+        'db_queries_per_message': round(scan_queries / max(ingested, 1), 3),
+        'outbox_drain_seconds': round(drain_s, 3),
+        'incremental_rescan': {
+            'seconds': round(rescan_s, 3),
+            'api_calls': sum(backend.calls.values()) - calls_before,
+            'db_queries': db['queries'] - queries_before,
+        },
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'stages': timer.summary(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--accounts', type=int, default=4)
+    parser.add_argument('--attachments', type=int, default=2, help='image attachments per message')
+    parser.add_argument('--attachment-bytes', type=int, default=20_000)
+    parser.add_argument('--dup-rate', type=float, default=0.2, help='share of attachments repeating earlier bytes')
+    parser.add_argument('--latency-ms', type=float, default=20.0, help='fake round-trip latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of API calls answered with 503')
+    parser.add_argument('--quota', type=float, default=1e9, help='per-user quota units/sec (250 = real Gmail)')
+    parser.add_argument('--account-workers', type=int, default=4)
+    parser.add_argument('--message-workers', type=int, default=4)
+    parser.add_argument('--digest', action='store_true')
+    parser.add_argument('--thread-length', type=int, default=1, help='consecutive messages per Gmail thread')
+    parser.add_argument('--thread-mode', action='store_true', help='ingest one item per thread (SCAN_THREAD_MODE)')
+    parser.add_argument('--noise-rate', type=float, default=0.0, help='share of matches that are newsletters')
+    parser.add_argument('--no-classifier', action='store_true', help='ingest every match at normal priority')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--messages', type=int, help=argparse.SUPPRESS)  # single-workload child mode
+    args = parser.parse_args()
+
+    if args.messages:
+        json.dump(run_workload(args), sys.stdout)
+        return
+
+    child_args = _strip_option(sys.argv[1:], '--sizes', len(args.sizes))
+    child_args = _strip_option(child_args, '--output', 1)
+    runs = []
+    for size in args.sizes:
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), *child_args, '--messages', str(size)],
+                              capture_output=True, text=True, cwd=ROOT)
+        if proc.returncode:
+            sys.stderr.write(proc.stderr)
+            raise SystemExit(f'workload {size} failed')
+        run = json.loads(proc.stdout.strip().splitlines()[-1])
+        runs.append(run)
+        print(f"{size:>6} msgs: {run['messages_per_sec']} msg/s, {run['api_calls_per_message']} calls/msg, "
+              f"{run['db_queries_per_message']} queries/msg, peak RSS {run['peak_rss_mb']} MB", file=sys.stderr)
+
+    commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, cwd=ROOT)
+    report = {'commit': commit.stdout.strip() or None, 'python': sys.version.split()[0],
+              'generated_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()), 'runs': runs}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Wrote {args.output}', file=sys.stderr)
+
+def _strip_option(argv, name, nvalues):
+    out, skip = [], 0
+    for a in argv:
+        if skip:
+            skip -= 1
+            continue
+        if a == name:
+            skip = nvalues
+            continue
+        if a.startswith(name + '='):
+            continue
+        out.append(a)
+    return out
+
+if __name__ == '__main__':
+    main()
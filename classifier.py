@@ -0,0 +1,155 @@
+"""Local pre-filter for keyword matches, run on message metadata before any attachment work.
+
+A Classifier sums the weights of its rules; a message scoring below the
+threshold is stored as low priority and skips attachment download, Drive
+upload and notification. Rules are plain callables taking the features dict
+and returning (weight, reason) or None, so more can be added with add_rule.
+"""
+import math
+import re
+from collections import Counter, namedtuple
+from email.utils import parseaddr
+
+from sqlalchemy.orm import load_only
+
+from models import EmailItem, Status
+
+PRIORITY_NORMAL = 'normal'
+PRIORITY_LOW = 'low'
+
+DOMAIN_WEIGHT = 10.0  # allow/deny lists override every other rule
+BULK_WEIGHT = -2.0
+# (pattern, weight) matched against subject and snippet
+TEXT_RULES = [
+    (r'\b(damaged?|broken|cracked|dent(ed)?|scratch(ed)?|torn|defect(ive)?)\b', 2.0),
+    (r'\b(arrived|delivery|delivered|photos?|pictures?|claim)\b', 1.0),
+    (r'\breplacement (part|piece)s?\b', 1.0),
+    (r'\b(credit card|credit score|statement|newsletter|unsubscribe|webinar)\b', -2.0),
+    (r'\b(invoice|receipt|order confirmation|payment (due|received))\b', -1.0),
+    (r'(\d+% off|\bsale\b|\bpromo(tion)?\b|\bdeals?\b)', -1.5),
+]
+TOKEN_RE = re.compile(r"[a-z][a-z']{2,}")
+MIN_TRAINING_ITEMS = 20  # per class before the token model is used
+TRAINING_LIMIT = 2000  # most recent labeled items per class
+MAX_TOKEN_SCORE = 4.0  # cap on the token model's contribution either way
+POSITIVE = (Status.RESOLVED, Status.CREDIT_RECEIVED)
+NEGATIVE = (Status.DISMISSED,)
+
+Verdict = namedtuple('Verdict', 'score priority reasons')
+
+def tokens(text):
+    return set(TOKEN_RE.findall((text or '').lower()))
+
+def features(full):
+    """Features of a Gmail message resource (metadata only)."""
+    headers = {h['name'].lower(): h['value'] for h in full.get('payload', {}).get('headers', [])}
+    address = parseaddr(headers.get('from', ''))[1].lower()
+    domain = address.rpartition('@')[2]
+    subject = headers.get('subject', '')
+    snippet = full.get('snippet', '')
+    return {
+        'domain': domain,
+        'text': f'{subject}\n{snippet}',
+        'bulk': 'list-unsubscribe' in headers or headers.get('precedence', '').lower() in ('bulk', 'list'),
+        'tokens': tokens(f'{subject} {snippet}') | ({'@' + domain} if domain else set()),
+    }
+
+def _domain_matches(domain, domains):
+    return any(domain == d or domain.endswith('.' + d) for d in domains)
+
+def domain_rule(allow, deny):
+    allow, deny = {d.lower() for d in allow}, {d.lower() for d in deny}
+
+    def rule(f):
+        if _domain_matches(f['domain'], allow):
+            return DOMAIN_WEIGHT, f"allowed domain {f['domain']}"
+        if _domain_matches(f['domain'], deny):
+            return -DOMAIN_WEIGHT, f"denied domain {f['domain']}"
+    return rule
+
+def bulk_rule(f):
+    if f['bulk']:
+        return BULK_WEIGHT, 'bulk mail headers'
+
+def text_rule(rules=TEXT_RULES):
+    compiled = [(re.compile(p, re.I), w) for p, w in rules]
+
+    def rule(f):
+        total, hits = 0.0, []
+        for pattern, weight in compiled:
+            m = pattern.search(f['text'])
+            if m:
+                total += weight
+                hits.append(m.group(0).lower())
+        if hits:
+            return total, 'text: ' + ', '.join(hits)
+    return rule
+
+class TokenModel:
+    """Naive Bayes log-odds per token, learned from items staff resolved (or
+    credited) versus dismissed."""
+    def __init__(self, weights):
+        self.weights = weights
+
+    @classmethod
+    def train(cls, session, limit=TRAINING_LIMIT):
+        """Return a model, or None until both classes have MIN_TRAINING_ITEMS items."""
+        counts, totals = {}, {}
+        for label, statuses in (('pos', POSITIVE), ('neg', NEGATIVE)):
+            rows = (session.query(EmailItem)
+                    .options(load_only(EmailItem.sender, EmailItem.subject, EmailItem.snippet))
+                    .filter(EmailItem.status.in_(statuses))
+                    .order_by(EmailItem.id.desc()).limit(limit).all())
+            if len(rows) < MIN_TRAINING_ITEMS:
+                return None
+            c = Counter()
+            for r in rows:
+                domain = parseaddr(r.sender or '')[1].lower().rpartition('@')[2]
+                c.update(tokens(f'{r.subject} {r.snippet}') | ({'@' + domain} if domain else set()))
+            counts[label], totals[label] = c, len(rows)
+        vocab = set(counts['pos']) | set(counts['neg'])
+        weights = {}
+        for t in vocab:
+            # Laplace-smoothed document frequencies per class
+            p = (counts['pos'][t] + 1) / (totals['pos'] + 2)
+            n = (counts['neg'][t] + 1) / (totals['neg'] + 2)
+            weights[t] = math.log(p / n)
+        return cls(weights)
+
+    def __call__(self, f):
+        total = sum(self.weights.get(t, 0.0) for t in f['tokens'])
+        if total:
+            return max(-MAX_TOKEN_SCORE, min(MAX_TOKEN_SCORE, total)), f'model {total:+.1f}'
+
+class Classifier:
+    def __init__(self, rules=(), threshold=0.0):
+        self.rules = list(rules)
+        self.threshold = threshold
+
+    def add_rule(self, rule):
+        self.rules.append(rule)
+        return rule
+
+    def classify(self, full):
+        f = features(full)
+        score, reasons = 0.0, []
+        for rule in self.rules:
+            hit = rule(f)
+            if hit:
+                score += hit[0]
+                reasons.append(hit[1])
+        priority = PRIORITY_LOW if score < self.threshold else PRIORITY_NORMAL
+        return Verdict(round(score, 2), priority, reasons)
+
+def build(session, CFG):
+    """The configured classifier, or None when CLASSIFIER_ENABLED is off."""
+    if not CFG.get('CLASSIFIER_ENABLED'):
+        return None
+    split = lambda v: [d.strip() for d in (v or '').split(',') if d.strip()]
+    clf = Classifier([domain_rule(split(CFG.get('CLASSIFIER_ALLOW_DOMAINS')), split(CFG.get('CLASSIFIER_DENY_DOMAINS'))),
+                      bulk_rule, text_rule()],
+                     threshold=CFG.get('CLASSIFIER_THRESHOLD', 0.0))
+    model = TokenModel.train(session)
+    if model is not None:
+        clf.add_rule(model)
+    return clf
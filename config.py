@@ -21,4 +21,26 @@ def load_config():
         'SERVICE_GOOGLE_ACCOUNT': os.getenv('SERVICE_GOOGLE_ACCOUNT', ''),
         'NOTIFY_EMAILS': os.getenv('NOTIFY_EMAILS', ''),
         'TASKS_SECRET': os.getenv('TASKS_SECRET', ''),
+        'NOTIFY_DIGEST': os.getenv('NOTIFY_DIGEST', '0') == '1',
+        'SCHEDULER_ENABLED': os.getenv('SCHEDULER_ENABLED', '1') == '1',
+        'SCAN_INTERVAL_MINUTES': int(os.getenv('SCAN_INTERVAL_MINUTES', '5')),
+        'DAILY_SUMMARY_HOUR': int(os.getenv('DAILY_SUMMARY_HOUR', '22')),  # UTC
+        'JOB_RUNS_RETENTION_DAYS': int(os.getenv('JOB_RUNS_RETENTION_DAYS', '14')),  # 0 keeps every run
+        'DASHBOARD_VERSION_TTL': float(os.getenv('DASHBOARD_VERSION_TTL', '2')),  # seconds between cache version checks
+        'DASHBOARD_BADGE_TTL': int(os.getenv('DASHBOARD_BADGE_TTL', '60')),
+        'SCAN_MAX_RESULTS': int(os.getenv('SCAN_MAX_RESULTS', '100')),  # search hits per account per scan
+        'SCAN_THREAD_MODE': os.getenv('SCAN_THREAD_MODE', '0') == '1',  # one item per Gmail thread
+        'THUMBNAIL_CACHE_MB': int(os.getenv('THUMBNAIL_CACHE_MB', '64')),  # per-process LRU of thumbnail bytes
+        'THUMBNAILS_AT_INGEST': os.getenv('THUMBNAILS_AT_INGEST', '1') == '1',
+        'CLASSIFIER_ENABLED': os.getenv('CLASSIFIER_ENABLED', '0') == '1',  # opt-in scan pre-filter
+        'CLASSIFIER_THRESHOLD': float(os.getenv('CLASSIFIER_THRESHOLD', '0')),  # scores below are low priority
+        'CLASSIFIER_ALLOW_DOMAINS': os.getenv('CLASSIFIER_ALLOW_DOMAINS', ''),  # comma-separated sender domains
+        'CLASSIFIER_DENY_DOMAINS': os.getenv('CLASSIFIER_DENY_DOMAINS', ''),
+        'SCAN_ACCOUNT_WORKERS': int(os.getenv('SCAN_ACCOUNT_WORKERS', '4')),
+        'SCAN_MESSAGE_WORKERS': int(os.getenv('SCAN_MESSAGE_WORKERS', '4')),
+        'DRIVE_UPLOAD_WORKERS': int(os.getenv('DRIVE_UPLOAD_WORKERS', '4')),
+        'DB_POOL_SIZE': int(os.getenv('DB_POOL_SIZE', '5')),  # connections kept open per process
+        'DB_POOL_OVERFLOW': int(os.getenv('DB_POOL_OVERFLOW', '10')),  # extra for web requests, on top of scan demand
+        'GMAIL_QUOTA_UNITS_PER_SEC': int(os.getenv('GMAIL_QUOTA_UNITS_PER_SEC', '250')),  # per user
+        'DRIVE_REQUESTS_PER_SEC': int(os.getenv('DRIVE_REQUESTS_PER_SEC', '200')),  # per user
     }
@@ -0,0 +1,11 @@
+def upsert(session, model, values, index_elements, set_):
+    """INSERT ... ON CONFLICT DO UPDATE on Postgres and SQLite, in one statement."""
+    dialect = session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise RuntimeError(f'upsert is not supported on {dialect}')
+    stmt = insert(model).values(**values)
+    session.execute(stmt.on_conflict_do_update(index_elements=index_elements, set_=set_))
@@ -1,32 +1,24 @@
 # drive_client.py
+from __future__ import annotations
+
+import io
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Tuple, Optional
+from typing import TYPE_CHECKING, List, Tuple, Optional, Union
 
-from google_auth_oauthlib.flow import Flow
-from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request
+from google_api import EXECUTOR
+from metrics import stage
+from service_cache import SERVICE_CACHE, build_service
 
-OPENID_SCOPES = [
-    "https://www.googleapis.com/auth/drive.file",
-    "https://www.googleapis.com/auth/drive",
-    "https://www.googleapis.com/auth/gmail.send",
-    "https://www.googleapis.com/auth/gmail.readonly",
-    "openid",
-    "https://www.googleapis.com/auth/userinfo.profile",
-    "https://www.googleapis.com/auth/userinfo.email",
-]
+# google-auth, oauthlib and the discovery client are imported where they are
+# used, so constructing a DriveManager (or checking has_token) stays cheap.
+if TYPE_CHECKING:
+    from google.oauth2.credentials import Credentials
 
-def _sanitize(email: str) -> str:
-    return email.replace("/", "_").replace("\\", "_").replace(":", "_")
-
-# drive_client.py
-import os
-from pathlib import Path
-from typing import Tuple, Optional
-from google_auth_oauthlib.flow import Flow
-from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # must be a multiple of 256 KiB
+UPLOAD_FIELDS = "id,webViewLink,webContentLink"
 
 OPENID_SCOPES = [
     "https://www.googleapis.com/auth/drive.file",
@@ -42,25 +34,42 @@ def _sanitize(email: str) -> str:
     return email.replace("/", "_").replace("\\", "_").replace(":", "_")
 
 class DriveManager:
-    def __init__(self, client_secrets_file: str, token_dir: str = "tokens", scopes: Optional[list] = None):
+    def __init__(self, client_secrets_file: str, token_dir: str = "tokens", scopes: Optional[list] = None,
+                 upload_folder_id: Optional[str] = None, upload_workers: int = 4):
         self.client_secrets_file = client_secrets_file
         self.token_dir = Path(token_dir)
-        self.token_dir.mkdir(parents=True, exist_ok=True)
         self.scopes = scopes or OPENID_SCOPES
-
-        data = Path(self.client_secrets_file).read_text(encoding="utf-8")
-        if '"web"' not in data:
-            raise ValueError("Your client_secret.json is not a Web application credential. Create a Web OAuth client in Google Cloud Console.")
+        self.upload_folder_id = upload_folder_id
+        self.upload_workers = max(1, upload_workers)
+        self._upload_pool = None
+        self._upload_pool_lock = threading.Lock()
 
     def _token_path(self, email: str) -> Path:
         return self.token_dir / f"{_sanitize(email)}.json"
 
-    def build_authorize_url(self, email: str, redirect_uri: str) -> Tuple[str, str]:
-        flow = Flow.from_client_secrets_file(
+    def _save_token(self, email: str, creds: Credentials) -> None:
+        self.token_dir.mkdir(parents=True, exist_ok=True)
+        self._token_path(email).write_text(creds.to_json(), encoding="utf-8")
+
+    def has_token(self, email: str) -> bool:
+        """Whether a token file exists for email, without loading or refreshing it."""
+        return self._token_path(email).exists()
+
+    def _flow(self, redirect_uri: str, state: Optional[str] = None):
+        from google_auth_oauthlib.flow import Flow
+
+        data = Path(self.client_secrets_file).read_text(encoding="utf-8")
+        if '"web"' not in data:
+            raise ValueError("Your client_secret.json is not a Web application credential. Create a Web OAuth client in Google Cloud Console.")
+        return Flow.from_client_secrets_file(
             self.client_secrets_file,
             scopes=self.scopes,
             redirect_uri=redirect_uri,
+            state=state,
         )
+
+    def build_authorize_url(self, email: str, redirect_uri: str) -> Tuple[str, str]:
+        flow = self._flow(redirect_uri)
         state = f"drive:{email}"
         authorization_url, flow_state = flow.authorization_url(
             access_type="offline",
@@ -71,19 +80,17 @@ class DriveManager:
         return authorization_url, flow_state
 
     def finish_authorize(self, email: str, authorization_response_url: str, redirect_uri: str, state: Optional[str] = None) -> bool:
-        flow = Flow.from_client_secrets_file(
-            self.client_secrets_file,
-            scopes=self.scopes,
-            redirect_uri=redirect_uri,
-            state=state,
-        )
+        flow = self._flow(redirect_uri, state=state)
         # Do NOT pass scope here; use the same scopes as the Flow
         flow.fetch_token(authorization_response=authorization_response_url)
-        creds = flow.credentials
-        self._token_path(email).write_text(creds.to_json(), encoding="utf-8")
+        self._save_token(email, flow.credentials)
+        SERVICE_CACHE.invalidate(email)
         return True
 
     def load_credentials(self, email: str) -> Optional[Credentials]:
+        from google.auth.transport.requests import Request
+        from google.oauth2.credentials import Credentials
+
         token_file = self._token_path(email)
         if not token_file.exists():
             return None
@@ -93,3 +100,67 @@ class DriveManager:
             token_file.write_text(creds.to_json(), encoding="utf-8")
         return creds
 
+    def _require_credentials(self, email: str) -> Credentials:
+        creds = self.load_credentials(email)
+        if not creds or not creds.valid:
+            raise RuntimeError(f"No Drive credentials for {email}. Connect via UI.")
+        return creds
+
+    def _service(self, email: str):
+        return SERVICE_CACHE.get(
+            ("drive", email),
+            lambda: self._require_credentials(email),
+            lambda creds: build_service("drive", "v3", creds),
+            save_credentials=lambda creds: self._save_token(email, creds),
+        )
+
+    @stage("drive_upload")
+    def upload_photo(self, email: str, filename: str, mime_type: str, data: bytes) -> Tuple[str, str, str]:
+        """Resumable, chunked upload into the upload folder; returns (file_id, webViewLink, webContentLink)."""
+        from googleapiclient.http import MediaIoBaseUpload
+
+        svc = self._service(email)
+        metadata = {"name": filename}
+        if self.upload_folder_id:
+            metadata["parents"] = [self.upload_folder_id]
+        media = MediaIoBaseUpload(io.BytesIO(data), mimetype=mime_type or "application/octet-stream",
+                                  chunksize=UPLOAD_CHUNK_SIZE, resumable=True)
+        request = svc.files().create(body=metadata, media_body=media, fields=UPLOAD_FIELDS, supportsAllDrives=True)
+        response = None
+        while response is None:
+            # A failed chunk is retried by EXECUTOR; the upload resumes from the last acknowledged byte
+            _, response = EXECUTOR.call("drive", email, request.next_chunk, method="drive.files.create")
+        return response["id"], response.get("webViewLink"), response.get("webContentLink")
+
+    @stage("drive_download")
+    def download_file(self, email: str, file_id: str) -> bytes:
+        """Download a Drive file's content in chunks through EXECUTOR."""
+        from googleapiclient.http import MediaIoBaseDownload
+
+        svc = self._service(email)
+        buf = io.BytesIO()
+        downloader = MediaIoBaseDownload(buf, svc.files().get_media(fileId=file_id, supportsAllDrives=True),
+                                         chunksize=UPLOAD_CHUNK_SIZE)
+        done = False
+        while not done:
+            _, done = EXECUTOR.call("drive", email, downloader.next_chunk, method="drive.files.get_media")
+        return buf.getvalue()
+
+    def upload_photos(self, email: str, attachments: List[dict]) -> List[Union[Tuple[str, str, str], Exception]]:
+        """Upload attachments on the shared upload pool.
+
+        Returns one (file_id, webViewLink, webContentLink) tuple or the raised
+        exception per attachment, in input order.
+        """
+        with self._upload_pool_lock:
+            if self._upload_pool is None:
+                self._upload_pool = ThreadPoolExecutor(max_workers=self.upload_workers, thread_name_prefix="drive-upload")
+        futures = [self._upload_pool.submit(self.upload_photo, email, a["filename"], a["mimeType"], a["data"])
+                   for a in attachments]
+        results = []
+        for f in futures:
+            try:
+                results.append(f.result())
+            except Exception as e:
+                results.append(e)
+        return results
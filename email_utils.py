@@ -15,17 +15,31 @@ def build_notification_html(item, photos):
     <p>Open in tracker: <a href="/detail/{item.id}" target="_blank" rel="noopener">View Item</a></p>
     """
 
-def build_daily_summary_html(items):
+def build_digest_html(bodies):
+    return f"<h3>{len(bodies)} new items tracked</h3>" + '<hr>'.join(bodies)
+
+def _stats_html(stats, trend):
+    by_status = ', '.join(f"{escape(s.replace('_', ' ').title())}: {n}" for s, n in stats['by_status'].items())
+    return f"""
+    <p><b>Received today:</b> {trend['today']} (yesterday {trend['yesterday']}, 7-day average {trend['avg_7d']})<br>
+       <b>All items:</b> {stats['total']} ({by_status})</p>
+    """
+
+def build_daily_summary_html(items, stats=None, trend=None, limit=None):
+    header = _stats_html(stats, trend) if stats else ''
     if not items:
-        return '<p>No new items today.</p>'
+        return header + '<p>No new items today.</p>'
+    more = f'<p>Showing the latest {limit} items.</p>' if limit and len(items) >= limit else ''
     rows = ''.join(
-        f"<tr><td>{escape(i.date)}</td><td>{escape(i.sender)}</td><td>{escape(i.subject)}</td><td>{escape(i.status.value)}</td></tr>"
+        f"<tr><td>{escape(i.date)}</td><td>{escape(i.sender)}</td><td>{escape(i.subject)}</td><td>{escape(i.status.value)}</td><td>{len(i.photos)}</td></tr>"
         for i in items
     )
     return f"""
     <h3>Daily Damage Summary</h3>
+    {header}
     <table border="1" cellpadding="6" cellspacing="0">
-      <thead><tr><th>Date</th><th>From</th><th>Subject</th><th>Status</th></tr></thead>
+      <thead><tr><th>Date</th><th>From</th><th>Subject</th><th>Status</th><th>Photos</th></tr></thead>
       <tbody>{rows}</tbody>
     </table>
+    {more}
     """
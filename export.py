@@ -0,0 +1,100 @@
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from models import EmailItem, Photo, Status
+
+EXPORT_BATCH_SIZE = 1000  # rows per server-side cursor fetch
+CSV_FLUSH_ROWS = 500  # rows per chunk written to the response
+
+ITEM_COLUMNS = [
+    ('item_id', EmailItem.id), ('gmail_message_id', EmailItem.gmail_message_id),
+    ('thread_id', EmailItem.thread_id), ('account_email', EmailItem.account_email),
+    ('sender', EmailItem.sender), ('subject', EmailItem.subject), ('date', EmailItem.date),
+    ('snippet', EmailItem.snippet), ('status', EmailItem.status), ('priority', EmailItem.priority),
+    ('score', EmailItem.score), ('received_at', EmailItem.received_at),
+    ('created_at', EmailItem.created_at),
+]
+PHOTO_COLUMNS = [
+    ('photo_id', Photo.id), ('photo_filename', Photo.filename), ('photo_mime_type', Photo.mime_type),
+    ('photo_size', Photo.size), ('drive_file_id', Photo.drive_file_id),
+    ('web_view_link', Photo.web_view_link), ('web_content_link', Photo.web_content_link),
+]
+COLUMNS = [name for name, _ in ITEM_COLUMNS + PHOTO_COLUMNS]
+
+def parse_date(value, end=False):
+    """Parse an ISO date or datetime; a bare end date covers that whole day."""
+    if not value:
+        return None
+    dt = datetime.fromisoformat(value)
+    if end and len(value) == 10:
+        dt += timedelta(days=1)
+    return dt
+
+def export_rows(session, status=None, start=None, end=None):
+    """Yield one dict per (item, photo) pair, oldest first; items without photos
+    appear once with empty photo fields.
+
+    Plain column rows through a server-side cursor, so nothing accumulates in
+    the session and memory stays flat however many rows match.
+    """
+    stmt = (select(*[c for _, c in ITEM_COLUMNS + PHOTO_COLUMNS])
+            .outerjoin(Photo, Photo.email_item_id == EmailItem.id)
+            .order_by(EmailItem.received_at, EmailItem.id, Photo.id))
+    if status:
+        stmt = stmt.where(EmailItem.status == Status[status])
+    if start:
+        stmt = stmt.where(EmailItem.received_at >= start)
+    if end:
+        stmt = stmt.where(EmailItem.received_at < end)
+    result = session.execute(stmt.execution_options(yield_per=EXPORT_BATCH_SIZE))
+    for row in result:
+        yield dict(zip(COLUMNS, row))
+
+def _cell(value):
+    if value is None:
+        return ''
+    if isinstance(value, Status):
+        return value.value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (int, float)):
+        # Numbers (score, size) are not formulas; a '-2.5' must stay numeric
+        return value
+    value = str(value)
+    # Keep spreadsheet apps from evaluating sender/subject text as formulas
+    if value[:1] in ('=', '+', '-', '@', '\t', '\r'):
+        return "'" + value
+    return value
+
+def iter_csv(rows):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(COLUMNS)
+    for n, row in enumerate(rows, 1):
+        writer.writerow([_cell(row[c]) for c in COLUMNS])
+        if n % CSV_FLUSH_ROWS == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+def iter_ndjson(rows):
+    """One JSON object per item with its photos nested (rows arrive grouped by item)."""
+    current = None
+    for row in rows:
+        if current is None or current['item_id'] != row['item_id']:
+            if current is not None:
+                yield json.dumps(current) + '\n'
+            current = {name: row[name] for name, _ in ITEM_COLUMNS}
+            current['status'] = current['status'].value
+            for key in ('received_at', 'created_at'):
+                current[key] = current[key].isoformat() if current[key] else None
+            current['photos'] = []
+        if row['photo_id'] is not None:
+            current['photos'].append({name: row[name] for name, _ in PHOTO_COLUMNS})
+    if current is not None:
+        yield json.dumps(current) + '\n'
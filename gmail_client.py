@@ -1,16 +1,112 @@
 import base64
+import time
 from email.mime.text import MIMEText
-from google_auth_oauthlib.flow import Flow
-from googleapiclient.discovery import build
 
-def _create_message(sender, to, subject, html_body):
+from google_api import EXECUTOR, is_retryable, is_throttled, quota_units
+from metrics import stage
+from service_cache import SERVICE_CACHE, build_service
+
+MAX_BATCH_SIZE = 100  # Gmail API limit on calls per batch request
+MAX_BATCH_BYTES = 20 * 1024 * 1024  # keep batched attachment responses a sane size
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.heic', '.gif', '.webp')
+MIME_FIELDS_DEPTH = 6  # nesting levels of multipart/* requested in partial responses
+
+def _part_fields(depth):
+    fields = 'partId,mimeType,filename,body(attachmentId,size)'
+    if depth > 1:
+        fields += f',parts({_part_fields(depth - 1)})'
+    return fields
+
+# Partial response for scans: headers, snippet and the MIME tree, but no body data
+MESSAGE_FIELDS = f'id,threadId,historyId,internalDate,snippet,payload(headers,{_part_fields(MIME_FIELDS_DEPTH)})'
+THREAD_FIELDS = f'id,historyId,messages({MESSAGE_FIELDS})'
+
+class HistoryExpiredError(RuntimeError):
+    """The stored historyId is too old for users.history.list; a full sync is needed."""
+
+def _create_message(sender, to, subject, html_body, bcc=None):
     msg = MIMEText(html_body, 'html')
     msg['To'] = to
     msg['From'] = sender
     msg['Subject'] = subject
+    if bcc:
+        msg['Bcc'] = bcc
     raw = base64.urlsafe_b64encode(msg.as_bytes()).decode()
     return {'raw': raw}
 
+def iter_mime_parts(part):
+    """Depth-first walk over a Gmail MIME tree, yielding every part."""
+    yield part
+    for child in part.get('parts') or ():
+        yield from iter_mime_parts(child)
+
+def _image_parts(message):
+    for part in iter_mime_parts(message.get('payload', {})):
+        mime = part.get('mimeType','')
+        body = part.get('body', {})
+        filename = part.get('filename')
+        if not filename:
+            continue
+        if not mime.startswith('image/'):
+            if not filename.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+        att_id = body.get('attachmentId')
+        if not att_id:
+            continue
+        yield {'messageId': message['id'], 'partId': part.get('partId'), 'filename': filename,
+               'mimeType': mime, 'attachmentId': att_id, 'size': body.get('size', 0)}
+
+def _run_batches(svc, email, requests, max_bytes=None):
+    """Execute (request_id, http_request, size) tuples over Gmail batch requests.
+
+    Each batch goes through the shared EXECUTOR, and sub-requests that fail with
+    429/5xx are re-batched with backoff. Returns {request_id: response}; raises
+    the first non-retryable (or exhausted) per-request error once all batches
+    have run, so a partial failure does not silently drop messages.
+    """
+    results = {}
+    pending = list(requests)
+    attempt = 0
+    while True:
+        errors = {}
+
+        def _callback(request_id, response, exception):
+            if exception is not None:
+                errors[request_id] = exception
+            else:
+                results[request_id] = response
+
+        def _flush(batch, units):
+            EXECUTOR.call('gmail', email, batch.execute, units, method='gmail.batch')
+
+        batch, count, total, units = None, 0, 0, 0
+        for request_id, req, size in pending:
+            if batch is not None and (count >= MAX_BATCH_SIZE or (max_bytes and count and total + size > max_bytes)):
+                _flush(batch, units)
+                batch = None
+            if batch is None:
+                batch, count, total, units = svc.new_batch_http_request(callback=_callback), 0, 0, 0
+            batch.add(req, request_id=request_id)
+            count += 1
+            total += size
+            units += quota_units(req.methodId)
+        if batch is not None:
+            _flush(batch, units)
+
+        if not errors:
+            return results
+        fatal = [e for e in errors.values() if not is_retryable(e)]
+        if fatal:
+            raise fatal[0]
+        if attempt >= EXECUTOR.max_retries:
+            raise next(iter(errors.values()))
+        retry = [r for r in pending if r[0] in errors]
+        if any(is_throttled(e) for e in errors.values()):
+            EXECUTOR.throttled('gmail', email)
+        time.sleep(EXECUTOR.backoff(attempt))
+        attempt += 1
+        pending = retry
+
 class GmailManager:
     def __init__(self, client_secrets_file, token_store, scopes):
         self.client_secrets_file = client_secrets_file
@@ -20,13 +116,23 @@ class GmailManager:
     def list_connected_accounts(self):
         return self.token_store.list_accounts()
 
-    def _service(self, email):
+    def _load_credentials(self, email):
         creds = self.token_store.load(email, self.scopes)
         if not creds or not creds.valid:
             raise RuntimeError(f"No Gmail credentials for {email}. Connect via UI.")
-        return build('gmail', 'v1', credentials=creds)
+        return creds
+
+    def _service(self, email):
+        return SERVICE_CACHE.get(
+            ('gmail', email),
+            lambda: self._load_credentials(email),
+            lambda creds: build_service('gmail', 'v1', creds),
+            save_credentials=lambda creds: self.token_store.save(email, 'gmail', creds),
+        )
 
     def build_authorize_url(self, email, redirect_uri):
+        from google_auth_oauthlib.flow import Flow
+
         flow = Flow.from_client_secrets_file(
             self.client_secrets_file,
             scopes=self.scopes,
@@ -41,6 +147,8 @@ class GmailManager:
         return auth_url, state
 
     def finish_authorize(self, email, code, redirect_uri, returned_scope=None):
+        from google_auth_oauthlib.flow import Flow
+
         flow = Flow.from_client_secrets_file(
             self.client_secrets_file,
             scopes=self.scopes,
@@ -56,41 +164,131 @@ class GmailManager:
             f.write(creds.to_json())
         return True
 
+    @stage('search')
     def search_messages(self, email, query, max_results=25):
+        """Return up to max_results matches, following nextPageToken past one page (500 max)."""
+        svc = self._service(email)
+        messages, page_token = [], None
+        while len(messages) < max_results:
+            resp = EXECUTOR.execute(email, svc.users().messages().list(
+                userId='me', q=query, maxResults=min(500, max_results - len(messages)), pageToken=page_token))
+            messages.extend(resp.get('messages', []))
+            page_token = resp.get('nextPageToken')
+            if not page_token:
+                break
+        return messages[:max_results]
+
+    def get_history_id(self, email):
+        svc = self._service(email)
+        return EXECUTOR.execute(email, svc.users().getProfile(userId='me'))['historyId']
+
+    @stage('search')
+    def list_history(self, email, start_history_id):
+        """Return (added_message_ids, latest_history_id) since start_history_id."""
+        from googleapiclient.errors import HttpError
+
+        svc = self._service(email)
+        added, seen = [], set()
+        latest = start_history_id
+        page_token = None
+        while True:
+            try:
+                resp = EXECUTOR.execute(email, svc.users().history().list(
+                    userId='me', startHistoryId=start_history_id,
+                    historyTypes=['messageAdded'], pageToken=page_token
+                ))
+            except HttpError as e:
+                if e.resp.status == 404:
+                    raise HistoryExpiredError(f"History {start_history_id} expired for {email}") from e
+                raise
+            for h in resp.get('history', []):
+                for ma in h.get('messagesAdded', []):
+                    msg_id = ma['message']['id']
+                    if msg_id not in seen:
+                        seen.add(msg_id)
+                        added.append(msg_id)
+            latest = resp.get('historyId', latest)
+            page_token = resp.get('nextPageToken')
+            if not page_token:
+                return added, latest
+
+    def get_message(self, email, msg_id, fields=MESSAGE_FIELDS):
+        """Fetch a message; pass fields=None for the full body."""
         svc = self._service(email)
-        resp = svc.users().messages().list(userId='me', q=query, maxResults=max_results).execute()
-        return resp.get('messages', [])
+        return EXECUTOR.execute(email, svc.users().messages().get(userId='me', id=msg_id, format='full', fields=fields))
 
-    def get_message(self, email, msg_id):
+    @stage('metadata_fetch')
+    def get_messages(self, email, msg_ids, fields=MESSAGE_FIELDS):
+        """Batched get_message; returns messages in the order of msg_ids."""
+        msg_ids = list(msg_ids)
+        if not msg_ids:
+            return []
         svc = self._service(email)
-        return svc.users().messages().get(userId='me', id=msg_id, format='full').execute()
+        results = _run_batches(svc, email, (
+            (msg_id, svc.users().messages().get(userId='me', id=msg_id, format='full', fields=fields), 0)
+            for msg_id in msg_ids
+        ))
+        return [results[msg_id] for msg_id in msg_ids]
+
+    @stage('metadata_fetch')
+    def get_threads(self, email, thread_ids, fields=THREAD_FIELDS):
+        """Batched threads.get (every message of each thread); returns threads in the order of thread_ids."""
+        thread_ids = list(thread_ids)
+        if not thread_ids:
+            return []
+        svc = self._service(email)
+        results = _run_batches(svc, email, (
+            (tid, svc.users().threads().get(userId='me', id=tid, format='full', fields=fields), 0)
+            for tid in thread_ids
+        ))
+        return [results[tid] for tid in thread_ids]
 
     def fetch_attachments(self, email, message):
+        return self.fetch_attachments_many(email, [message])[message['id']]
+
+    def attachment_parts(self, message):
+        """Yield image attachment descriptors from any depth of the MIME tree (nothing downloaded)."""
+        return _image_parts(message)
+
+    @stage('attachment_download')
+    def download_attachments(self, email, parts):
+        """Download attachment_parts descriptors over batch requests.
+
+        Returns one attachment dict per descriptor, in order, with the decoded
+        bytes in 'data'.
+        """
+        parts = list(parts)
+        if not parts:
+            return []
         svc = self._service(email)
-        attachments = []
-        payload = message.get('payload', {})
-        parts = payload.get('parts') or [payload]
-        for part in parts:
-            mime = part.get('mimeType','')
-            body = part.get('body', {})
-            filename = part.get('filename')
-            if not filename:
-                continue
-            if not mime.startswith('image/'):
-                if not any(filename.lower().endswith(ext) for ext in ['.jpg','.jpeg','.png','.heic','.gif','.webp']):
-                    continue
-            att_id = body.get('attachmentId')
-            if not att_id:
-                continue
-            att = svc.users().messages().attachments().get(userId='me', messageId=message['id'], id=att_id).execute()
-            data = base64.urlsafe_b64decode(att['data'])
-            attachments.append({'filename': filename, 'mimeType': mime, 'data': data, 'size': str(len(data))})
-        return attachments
+        results = _run_batches(svc, email, (
+            (str(i),
+             svc.users().messages().attachments().get(userId='me', messageId=part['messageId'], id=part['attachmentId']),
+             part['size'])
+            for i, part in enumerate(parts)
+        ), max_bytes=MAX_BATCH_BYTES)
+        out = []
+        for i, part in enumerate(parts):
+            data = base64.urlsafe_b64decode(results[str(i)]['data'])
+            out.append({'filename': part['filename'], 'mimeType': part['mimeType'], 'partId': part['partId'],
+                        'data': data, 'size': str(len(data))})
+        return out
+
+    def fetch_attachments_many(self, email, messages):
+        """Download image attachments for several messages; returns {message_id: [attachment, ...]}."""
+        parts = [part for m in messages for part in _image_parts(m)]
+        out = {m['id']: [] for m in messages}
+        for part, att in zip(parts, self.download_attachments(email, parts)):
+            out[part['messageId']].append(att)
+        return out
 
-    def send_email(self, sender_email, to_emails, subject, html_body):
+    @stage('notification_send')
+    def send_email(self, sender_email, to_emails, subject, html_body, bcc=None):
+        """Send one message addressed to every recipient (a single messages.send call)."""
         svc = self._service(sender_email)
         if isinstance(to_emails, str):
             to_emails = [to_emails]
-        for to in to_emails:
-            message = _create_message(sender_email, to, subject, html_body)
-            svc.users().messages().send(userId='me', body=message).execute()
+        if isinstance(bcc, (list, tuple)):
+            bcc = ', '.join(bcc)
+        message = _create_message(sender_email, ', '.join(to_emails), subject, html_body, bcc=bcc)
+        EXECUTOR.execute(sender_email, svc.users().messages().send(userId='me', body=message))
@@ -0,0 +1,194 @@
+import random
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import METRICS
+
+# Gmail API quota units per method (per-user limit is 250 units/second)
+GMAIL_QUOTA_UNITS = {
+    'gmail.users.getProfile': 1,
+    'gmail.users.history.list': 2,
+    'gmail.users.messages.list': 5,
+    'gmail.users.messages.get': 5,
+    'gmail.users.messages.attachments.get': 5,
+    'gmail.users.threads.list': 10,
+    'gmail.users.threads.get': 10,
+    'gmail.users.messages.send': 100,
+}
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+TRANSIENT_ERRORS = (ConnectionError, TimeoutError, socket.timeout)
+
+def quota_units(method_id):
+    return GMAIL_QUOTA_UNITS.get(method_id, 1)
+
+def _http_error():
+    # Imported on the error path only; importing this module must not load the client library
+    from googleapiclient.errors import HttpError
+    return HttpError
+
+def is_throttled(exc):
+    if not isinstance(exc, _http_error()):
+        return False
+    if exc.resp.status == 429:
+        return True
+    # Gmail and Drive also signal rate limits as 403 rateLimitExceeded/userRateLimitExceeded
+    content = exc.content.decode('utf-8', 'replace') if isinstance(exc.content, bytes) else str(exc.content or '')
+    return exc.resp.status == 403 and 'ratelimitexceeded' in content.lower()
+
+def is_retryable(exc):
+    if isinstance(exc, _http_error()):
+        return exc.resp.status in RETRY_STATUSES or is_throttled(exc)
+    return isinstance(exc, TRANSIENT_ERRORS)
+
+class TokenBucket:
+    """Thread-safe token bucket. A request costing more than the burst capacity
+    is let through once the bucket is full and leaves it in debt, so the
+    long-run rate still holds."""
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self._tokens = self.capacity
+        self._ts = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _fill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._ts) * self.rate)
+        self._ts = now
+
+    def acquire(self, units=1):
+        need = min(units, self.capacity)
+        while True:
+            with self._lock:
+                self._fill()
+                if self._tokens >= need:
+                    self._tokens -= units
+                    return
+                wait = (need - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def drain(self):
+        with self._lock:
+            self._fill()
+            self._tokens = min(self._tokens, 0.0)
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit: +1 after a full window of successes, halved on throttling."""
+    def __init__(self, initial=8, minimum=1, maximum=32):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self._in_flight = 0
+        self._successes = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def slot(self):
+        with self._cond:
+            while self._in_flight >= self.limit:
+                self._cond.wait()
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._in_flight -= 1
+                self._cond.notify()
+
+    def on_success(self):
+        with self._cond:
+            self._successes += 1
+            if self._successes >= self.limit and self.limit < self.maximum:
+                self.limit += 1
+                self._successes = 0
+                self._cond.notify()
+
+    def on_throttle(self):
+        with self._cond:
+            now = time.monotonic()
+            # One decrease per second so a burst of 429s from one window counts once
+            if now - self._last_decrease >= 1.0:
+                self.limit = max(self.minimum, self.limit // 2)
+                self._successes = 0
+                self._last_decrease = now
+
+class ApiExecutor:
+    """Runs Google API calls under a per-(api, user) quota bucket and adaptive
+    concurrency limit, retrying 429/5xx and transient errors with full-jitter
+    exponential backoff."""
+    def __init__(self, rates=None, max_retries=5, base_delay=1.0, max_delay=32.0):
+        self.rates = {'gmail': 250, 'drive': 200}
+        self.rates.update(rates or {})
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._buckets = {}
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def configure(self, rates=None, max_retries=None):
+        with self._lock:
+            self.rates.update(rates or {})
+            if max_retries is not None:
+                self.max_retries = max_retries
+            self._buckets.clear()
+
+    def _bucket(self, api, user):
+        with self._lock:
+            key = (api, user)
+            if key not in self._buckets:
+                self._buckets[key] = TokenBucket(self.rates.get(api, 10))
+            return self._buckets[key]
+
+    def limiter(self, api, user):
+        with self._lock:
+            key = (api, user)
+            if key not in self._limiters:
+                self._limiters[key] = AdaptiveLimiter()
+            return self._limiters[key]
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def throttled(self, api, user):
+        self.limiter(api, user).on_throttle()
+        self._bucket(api, user).drain()
+
+    def call(self, api, user, fn, units=1, method=None):
+        """Call fn() under the quota bucket and concurrency limit for (api, user)."""
+        bucket = self._bucket(api, user)
+        limiter = self.limiter(api, user)
+        method = method or api
+        attempt = 0
+        while True:
+            bucket.acquire(units)
+            with limiter.slot():
+                METRICS.inc('google_api_calls_total', api=api, method=method, account=user)
+                try:
+                    result = fn()
+                except Exception as e:
+                    status = e.resp.status if isinstance(e, _http_error()) else type(e).__name__
+                    METRICS.inc('google_api_errors_total', api=api, method=method, account=user, status=status)
+                    if not is_retryable(e) or attempt >= self.max_retries:
+                        raise
+                    if is_throttled(e):
+                        self.throttled(api, user)
+                else:
+                    limiter.on_success()
+                    return result
+            METRICS.inc('google_api_retries_total', api=api, method=method, account=user)
+            time.sleep(self.backoff(attempt))
+            attempt += 1
+
+    def execute(self, user, request, units=None):
+        """Execute a googleapiclient HttpRequest on behalf of user."""
+        api = request.methodId.split('.', 1)[0]
+        if units is None:
+            units = quota_units(request.methodId)
+        return self.call(api, user, request.execute, units, method=request.methodId)
+
+EXECUTOR = ApiExecutor()
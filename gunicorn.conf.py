@@ -0,0 +1,6 @@
+# Loaded by gunicorn from the working directory (Procfile / render.yaml pass it explicitly)
+
+def post_worker_init(worker):
+    # Background jobs run in serving workers only, never when app is imported by the CLI or scripts
+    from app import start_scheduler
+    start_scheduler()
@@ -0,0 +1,149 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _labels(pairs, extra=()):
+    pairs = tuple(pairs) + tuple(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+class Registry:
+    """Minimal thread-safe counters and histograms rendered in Prometheus text format.
+
+    An update is one dict operation under a lock, cheap enough to leave on in production.
+    """
+    def __init__(self, prefix='damage_tracker_'):
+        self.prefix = prefix
+        self._meta = {}
+        self._counters = {}
+        self._hists = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, help_text):
+        self._meta[name] = ('counter', help_text, None)
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self._meta[name] = ('histogram', help_text, tuple(buckets))
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        buckets = self._meta[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        slot = bisect.bisect_left(buckets, value)
+        with self._lock:
+            hist = self._hists.get(key)
+            if hist is None:
+                hist = self._hists[key] = [[0] * (len(buckets) + 1), 0.0]
+            hist[0][slot] += 1
+            hist[1] += value
+
+    @contextmanager
+    def timed(self, name, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0, **labels)
+
+    def render(self):
+        with self._lock:
+            counters = dict(self._counters)
+            hists = {k: ([*v[0]], v[1]) for k, v in self._hists.items()}
+        lines = []
+        for name, (kind, help_text, buckets) in sorted(self._meta.items()):
+            full = self.prefix + name
+            lines.append(f'# HELP {full} {help_text}')
+            lines.append(f'# TYPE {full} {kind}')
+            if kind == 'counter':
+                for (n, labels), value in sorted(counters.items()):
+                    if n == name:
+                        lines.append(f'{full}{_labels(labels)} {value}')
+                continue
+            for (n, labels), (counts, total) in sorted(hists.items()):
+                if n != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + (float('inf'),), counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{full}_bucket{_labels(labels, [("le", le)])} {cumulative}')
+                lines.append(f'{full}_sum{_labels(labels)} {total}')
+                lines.append(f'{full}_count{_labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._hists.clear()
+
+METRICS = Registry()
+METRICS.histogram('scan_stage_seconds', 'Duration of scan pipeline stages.')
+METRICS.counter('scan_items_total', 'Email items ingested by scans.')
+METRICS.counter('scan_low_priority_total', 'Messages the pre-filter stored as low priority (no attachments, Drive or notification).')
+METRICS.counter('google_api_calls_total', 'Google API calls (a batch counts once), by account.')
+METRICS.counter('google_api_errors_total', 'Failed Google API call attempts, by HTTP status.')
+METRICS.counter('google_api_retries_total', 'Google API calls retried after 429/5xx/transient errors.')
+METRICS.counter('token_loads_total', 'OAuth credential loads from the token store.')
+METRICS.counter('service_cache_requests_total', 'Google client cache lookups by result.')
+METRICS.counter('db_queries_total', 'SQL statements executed, by verb.')
+METRICS.histogram('db_query_seconds', 'SQL statement duration, by verb.',
+                  buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+
+def stage(name):
+    """Time one scan pipeline stage."""
+    return METRICS.timed('scan_stage_seconds', stage=name)
+
+@contextmanager
+def count_queries(engine):
+    """Collect the SQL statements engine executes inside the block (a list)."""
+    statements = []
+
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'after_cursor_execute', _after)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'after_cursor_execute', _after)
+
+@contextmanager
+def assert_max_queries(engine, limit):
+    """Raise AssertionError if the block runs more than limit statements; pins a
+    code path to a fixed query count however many rows it returns."""
+    with count_queries(engine) as statements:
+        yield statements
+    if len(statements) > limit:
+        raise AssertionError(f'{len(statements)} queries, expected at most {limit}:\n' + '\n'.join(statements))
+
+def instrument_engine(engine):
+    """Count and time every SQL statement through SQLAlchemy engine events."""
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_t0', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['metrics_t0'].pop()
+        verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'OTHER'
+        METRICS.inc('db_queries_total', verb=verb)
+        METRICS.observe('db_query_seconds', elapsed, verb=verb)
+
+    @event.listens_for(engine, 'handle_error')
+    def _error(context):
+        stack = context.connection.info.get('metrics_t0') if context.connection is not None else None
+        if stack:
+            stack.pop()
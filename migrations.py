@@ -0,0 +1,61 @@
+from sqlalchemy import Enum, inspect, text
+from sqlalchemy.orm import Session
+
+import rollups
+import search
+from models import Base, ItemRollup
+
+# Indexes no longer declared on the models, dropped from existing databases
+DROPPED_INDEXES = [
+    'ix_email_items_created_id',  # the item list pages on received_at since the backfill
+    'ix_email_items_status_created_id',
+]
+
+def migrate(engine):
+    """Create missing tables, then add the columns and indexes that create_all
+    skips on tables that already exist and drop DROPPED_INDEXES. New columns
+    must be nullable. Ends with the batched received_at backfill."""
+    had_rollups = inspect(engine).has_table(ItemRollup.__tablename__)
+    Base.metadata.create_all(engine)
+    if engine.dialect.name == 'postgresql':
+        # create_all does not touch existing enum types; add members appended to the Python enums
+        types = {c.type.name: c.type.enums for t in Base.metadata.sorted_tables for c in t.columns
+                 if isinstance(c.type, Enum) and c.type.name}
+        with engine.begin() as conn:
+            for name, values in types.items():
+                for value in values:
+                    conn.execute(text(f"ALTER TYPE {engine.dialect.identifier_preparer.quote(name)} "
+                                      f"ADD VALUE IF NOT EXISTS '{value}'"))
+    insp = inspect(engine)
+    quote = engine.dialect.identifier_preparer.quote
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {c['name'] for c in insp.get_columns(table.name)}
+            for col in table.columns:
+                if col.name not in existing:
+                    col_type = col.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f'ALTER TABLE {quote(table.name)} ADD COLUMN {quote(col.name)} {col_type}'))
+            indexes = {i['name'] for i in insp.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(conn)
+        for name in DROPPED_INDEXES:
+            conn.execute(text(f'DROP INDEX IF EXISTS {quote(name)}'))
+    search.install(engine)
+    if not had_rollups:
+        # Seed the counters once from existing items; from here on they are maintained incrementally
+        with Session(engine) as session:
+            rollups.rebuild(session)
+            session.commit()
+    # The item list pages on received_at; fill it on legacy rows before new code serves them
+    from tasks import backfill_received_at
+    with Session(engine) as session:
+        backfill_received_at(session)
+
+if __name__ == '__main__':
+    from sqlalchemy import create_engine
+
+    from config import load_config
+
+    migrate(create_engine(load_config()['DATABASE_URL'], future=True))
+    print('Database schema is up to date.')
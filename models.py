@@ -1,5 +1,5 @@
 from sqlalchemy.orm import declarative_base, relationship
-from sqlalchemy import Column, Integer, String, DateTime, Enum, ForeignKey, Text, UniqueConstraint
+from sqlalchemy import Column, Integer, String, Date, DateTime, Enum, Float, ForeignKey, Text, UniqueConstraint, Index, Boolean, LargeBinary
 from datetime import datetime
 import enum
 
@@ -9,6 +9,12 @@ class Status(enum.Enum):
     NEW = 'NEW'
     RESOLVED = 'RESOLVED'
     CREDIT_RECEIVED = 'CREDIT_RECEIVED'
+    DISMISSED = 'DISMISSED'  # not a damage report; negative training data for the classifier
+
+class OutboxStatus(enum.Enum):
+    PENDING = 'PENDING'
+    SENT = 'SENT'
+    FAILED = 'FAILED'
 
 class EmailItem(Base):
     __tablename__ = 'email_items'
@@ -24,13 +30,40 @@ class EmailItem(Base):
 
     status = Column(Enum(Status), default=Status.NEW, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
+    received_at = Column(DateTime)  # UTC, from Gmail internalDate (Date header for backfilled rows)
+    priority = Column(String(16))  # classifier.PRIORITY_*; NULL for items stored before the classifier
+    score = Column(Float)  # classifier score at ingest
 
     photos = relationship('Photo', back_populates='email_item', cascade='all, delete-orphan')
+    messages = relationship('EmailMessage', back_populates='email_item', cascade='all, delete-orphan',
+                            order_by='EmailMessage.received_at')
+
+    # Keyset pagination and range scans on (received_at, id), optionally filtered by status
+    __table_args__ = (
+        Index('ix_email_items_received_id', 'received_at', 'id'),
+        Index('ix_email_items_status_received_id', 'status', 'received_at', 'id'),
+        Index('ix_email_items_account_thread', 'account_email', 'thread_id'),
+    )
+
+class EmailMessage(Base):
+    """A Gmail message folded into a thread-level item (SCAN_THREAD_MODE)."""
+    __tablename__ = 'email_messages'
+    id = Column(Integer, primary_key=True)
+    email_item_id = Column(Integer, ForeignKey('email_items.id', ondelete='CASCADE'), index=True, nullable=False)
+    gmail_message_id = Column(String(128), unique=True, nullable=False)
+
+    sender = Column(String(255))
+    date = Column(String(128))  # RFC822 string
+    snippet = Column(Text)
+    received_at = Column(DateTime)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    email_item = relationship('EmailItem', back_populates='messages')
 
 class Photo(Base):
     __tablename__ = 'photos'
     id = Column(Integer, primary_key=True)
-    email_item_id = Column(Integer, ForeignKey('email_items.id', ondelete='CASCADE'))
+    email_item_id = Column(Integer, ForeignKey('email_items.id', ondelete='CASCADE'), index=True)
 
     filename = Column(String(512))
     mime_type = Column(String(255))
@@ -40,8 +73,31 @@ class Photo(Base):
     web_view_link = Column(String(1024))
     web_content_link = Column(String(1024))
 
+    content_hash = Column(String(64), index=True)  # SHA-256 of the attachment bytes
+    part_id = Column(String(64))  # Gmail MIME partId the photo came from
+
     email_item = relationship('EmailItem', back_populates='photos')
 
+    __table_args__ = (Index('ix_photos_attachment_meta', 'filename', 'size'),)
+
+class ItemRollup(Base):
+    """Item counts per (received day, account, status), kept current by rollups.add
+    in the same transaction as every insert or status change."""
+    __tablename__ = 'item_rollups'
+    day = Column(Date, primary_key=True)  # UTC day of received_at (created_at before the backfill)
+    account_email = Column(String(255), primary_key=True)
+    status = Column(String(32), primary_key=True)  # a Status value
+    count = Column(Integer, nullable=False, default=0)
+
+class Thumbnail(Base):
+    """Downscaled JPEG of a photo, keyed by its content hash (or Drive file id) so duplicates share one."""
+    __tablename__ = 'photo_thumbnails'
+    source_key = Column(String(160), primary_key=True)
+    size = Column(String(8), primary_key=True)  # a key of thumbnails.SIZES
+    mime_type = Column(String(64), nullable=False)
+    data = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 class OAuthToken(Base):
     __tablename__ = 'oauth_tokens'
     id = Column(Integer, primary_key=True)
@@ -51,3 +107,62 @@ class OAuthToken(Base):
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     __table_args__ = (UniqueConstraint('email','provider', name='uq_email_provider'),)
+
+class SyncState(Base):
+    """Per-account Gmail historyId checkpoint for incremental scans."""
+    __tablename__ = 'gmail_sync_state'
+    id = Column(Integer, primary_key=True)
+    account_email = Column(String(255), nullable=False, unique=True)
+    history_id = Column(String(64))
+    # JSON {message_id: first seen (ISO)} of new messages the keyword search has not returned yet
+    pending_ids = Column(Text)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class Notification(Base):
+    """Outbox row for an email that still has to be sent; written in the same
+    transaction as the data it reports on and delivered by tasks.drain_outbox."""
+    __tablename__ = 'notification_outbox'
+    id = Column(Integer, primary_key=True)
+    email_item_id = Column(Integer, ForeignKey('email_items.id', ondelete='SET NULL'))
+    kind = Column(String(32), nullable=False, default='item')  # 'item' or 'summary'
+    subject = Column(String(1000), nullable=False)
+    html_body = Column(Text, nullable=False)
+    recipients = Column(Text, nullable=False)  # comma-separated
+
+    status = Column(Enum(OutboxStatus), default=OutboxStatus.PENDING, nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    last_error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime)
+
+    __table_args__ = (Index('ix_outbox_status_next_attempt', 'status', 'next_attempt_at'),)
+
+class JobLease(Base):
+    """Leader lease for a scheduled job on databases without advisory locks (SQLite)."""
+    __tablename__ = 'job_leases'
+    name = Column(String(64), primary_key=True)
+    owner = Column(String(128))
+    expires_at = Column(DateTime)
+
+class JobRun(Base):
+    __tablename__ = 'job_runs'
+    id = Column(Integer, primary_key=True)
+    job_name = Column(String(64), nullable=False)
+    trigger = Column(String(16), nullable=False)  # 'schedule' or 'manual'
+    owner = Column(String(128))
+    started_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    finished_at = Column(DateTime)
+    duration_ms = Column(Integer)
+    ok = Column(Boolean)
+    result = Column(Text)  # JSON
+    error = Column(Text)
+
+    __table_args__ = (Index('ix_job_runs_name_started', 'job_name', 'started_at'),)
+
+class CacheVersion(Base):
+    """Monotonic counter per cached view, bumped in the transaction that changes its data."""
+    __tablename__ = 'cache_versions'
+    name = Column(String(64), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -0,0 +1,69 @@
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+def _encode_value(v):
+    return {'dt': v.isoformat()} if isinstance(v, datetime) else v
+
+def _decode_value(v):
+    return datetime.fromisoformat(v['dt']) if isinstance(v, dict) else v
+
+def encode_cursor(values):
+    raw = json.dumps([_encode_value(v) for v in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Return the key values stored in a cursor, or None if it is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        return [_decode_value(v) for v in json.loads(raw)]
+    except (ValueError, TypeError, KeyError):
+        return None
+
+def _seek(keys, values, forward):
+    # Rows strictly after `values` in sort order (before it when not forward):
+    # (k0 > v0) OR (k0 = v0 AND k1 > v1) OR ..., with > / < per key direction.
+    clauses = []
+    for i, ((expr, desc), value) in enumerate(zip(keys, values)):
+        after = (expr < value) if desc == forward else (expr > value)
+        clauses.append(and_(*[k == v for (k, _), v in zip(keys[:i], values[:i])], after))
+    lead_expr, lead_desc = keys[0]
+    # Redundant bound on the leading key so the planner can use an index range scan
+    lead = (lead_expr <= values[0]) if lead_desc == forward else (lead_expr >= values[0])
+    return and_(lead, or_(*clauses))
+
+def keyset_page(query, keys, key_values, after=None, before=None, limit=DEFAULT_PAGE_SIZE):
+    """Fetch one page of `query` ordered by `keys` using keyset pagination.
+
+    keys is a list of (expression, descending) pairs ending in a unique column;
+    key_values(row) returns the row's values for those keys. Pass the `after`
+    cursor for the next page or `before` for the previous one.
+    Returns (rows, next_cursor, prev_cursor); a cursor is None at either end.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    values = decode_cursor(before) if before else decode_cursor(after) if after else None
+    forward = not (before and values)
+    if values and len(values) == len(keys):
+        query = query.filter(_seek(keys, values, forward))
+    else:
+        values = None
+
+    order = [(expr.desc() if desc == forward else expr.asc()) for expr, desc in keys]
+    rows = query.order_by(None).order_by(*order).limit(limit + 1).all()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if not forward:
+        rows.reverse()
+
+    if not rows:
+        return rows, None, None
+    has_next = more if forward else True
+    has_prev = bool(values) if forward else more
+    next_cursor = encode_cursor(key_values(rows[-1])) if has_next else None
+    prev_cursor = encode_cursor(key_values(rows[0])) if has_prev else None
+    return rows, next_cursor, prev_cursor
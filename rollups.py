@@ -0,0 +1,85 @@
+from collections import Counter
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, insert, select
+
+from db import upsert
+from models import EmailItem, ItemRollup, Status
+
+STATS_DAYS = 14  # days of daily counts on the dashboard and in /api/stats by default
+
+def item_day(received_at, created_at=None):
+    """The day an item is counted under: when the email arrived (UTC), else when it was stored."""
+    ts = received_at or created_at or datetime.utcnow()
+    return ts.date()
+
+def add(session, deltas):
+    """Apply {(day, account_email, status): delta} in the session's transaction, one upsert per key."""
+    for (day, account, status), delta in deltas.items():
+        if not delta:
+            continue
+        status = status.value if isinstance(status, Status) else status
+        upsert(session, ItemRollup, {'day': day, 'account_email': account or '', 'status': status, 'count': delta},
+               ['day', 'account_email', 'status'], {'count': ItemRollup.count + delta})
+
+def moved(item, old_status, new_status):
+    """Deltas for one item changing status."""
+    day = item_day(item.received_at, item.created_at)
+    return Counter({(day, item.account_email, old_status): -1, (day, item.account_email, new_status): 1})
+
+def rebuild(session):
+    """Recompute every row from email_items (first install, or after manual edits)."""
+    day = func.date(func.coalesce(EmailItem.received_at, EmailItem.created_at, func.current_timestamp()))
+    rows = session.execute(select(day, EmailItem.account_email, EmailItem.status, func.count())
+                           .group_by(day, EmailItem.account_email, EmailItem.status)).all()
+    counts = Counter()
+    for d, account, status, n in rows:
+        # SQLite's date() returns text
+        d = datetime.strptime(d, '%Y-%m-%d').date() if isinstance(d, str) else d
+        counts[(d, account or '', status.value)] += n
+    session.execute(delete(ItemRollup))
+    if counts:
+        session.execute(insert(ItemRollup), [{'day': d, 'account_email': a, 'status': s, 'count': n}
+                                             for (d, a, s), n in counts.items()])
+    return len(counts)
+
+def stats(session, days=STATS_DAYS):
+    """Counts by status, by account and per day for the last `days` days.
+
+    Two grouped reads over the rollup table, so the cost follows days x accounts,
+    not the number of items.
+    """
+    by_status, by_account = Counter(), {}
+    for account, status, n in session.execute(
+            select(ItemRollup.account_email, ItemRollup.status, func.sum(ItemRollup.count))
+            .group_by(ItemRollup.account_email, ItemRollup.status)):
+        by_status[status] += n
+        by_account.setdefault(account, Counter())[status] += n
+
+    today = datetime.utcnow().date()
+    since = today - timedelta(days=days - 1)
+    daily = {since + timedelta(days=i): Counter() for i in range(days)}
+    for day, status, n in session.execute(
+            select(ItemRollup.day, ItemRollup.status, func.sum(ItemRollup.count))
+            .where(ItemRollup.day >= since).group_by(ItemRollup.day, ItemRollup.status)):
+        if day in daily:
+            daily[day][status] += n
+
+    statuses = [s.value for s in Status]
+    return {
+        'total': sum(by_status.values()),
+        'by_status': {s: by_status[s] for s in statuses},
+        'by_account': {a: {s: c[s] for s in statuses} for a, c in sorted(by_account.items())},
+        'daily': [{'day': d.isoformat(), 'received': sum(c.values()), **{s: c[s] for s in statuses}}
+                  for d, c in sorted(daily.items())],
+    }
+
+def trend(stats_json):
+    """Received today, yesterday and the average of the 7 days before today, from stats()['daily']."""
+    received = [d['received'] for d in stats_json['daily']]
+    previous = received[-8:-1]
+    return {
+        'today': received[-1] if received else 0,
+        'yesterday': received[-2] if len(received) > 1 else 0,
+        'avg_7d': round(sum(previous) / len(previous), 1) if previous else 0.0,
+    }
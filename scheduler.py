@@ -0,0 +1,182 @@
+import json
+import os
+import socket
+import time
+import uuid
+import zlib
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from apscheduler.schedulers.background import BackgroundScheduler
+from sqlalchemy import delete, or_, text, update
+from sqlalchemy.exc import IntegrityError
+
+from models import JobLease, JobRun
+
+OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+LEASE_TTL = timedelta(minutes=30)  # must outlast the longest job run
+
+@contextmanager
+def leader_lock(engine, name):
+    """Yield True if this process won the lock for job `name`, False otherwise.
+
+    Postgres uses a session-level advisory lock held on a dedicated connection;
+    other databases (SQLite in dev) use an expiring lease row in job_leases.
+    """
+    if engine.dialect.name == 'postgresql':
+        key = zlib.crc32(name.encode())
+        with engine.connect() as conn:
+            got = conn.execute(text('SELECT pg_try_advisory_lock(:k)'), {'k': key}).scalar()
+            conn.commit()
+            try:
+                yield bool(got)
+            finally:
+                if got:
+                    conn.execute(text('SELECT pg_advisory_unlock(:k)'), {'k': key})
+                    conn.commit()
+        return
+
+    now = datetime.utcnow()
+    try:
+        with engine.begin() as conn:
+            conn.execute(JobLease.__table__.insert().values(name=name, owner=None, expires_at=now))
+    except IntegrityError:
+        pass
+    with engine.begin() as conn:
+        got = conn.execute(
+            update(JobLease)
+            .where(JobLease.name == name, or_(JobLease.expires_at <= now, JobLease.owner == OWNER))
+            .values(owner=OWNER, expires_at=now + LEASE_TTL)
+        ).rowcount == 1
+    try:
+        yield got
+    finally:
+        if got:
+            with engine.begin() as conn:
+                conn.execute(
+                    update(JobLease)
+                    .where(JobLease.name == name, JobLease.owner == OWNER)
+                    .values(owner=None, expires_at=datetime.utcnow())
+                )
+
+class JobScheduler:
+    """In-process APScheduler wrapper; every gunicorn worker runs one, and the
+    leader lock makes sure exactly one of them executes each job run. Runs
+    older than `retention` are deleted as each job finishes."""
+    def __init__(self, engine, SessionFactory, retention=None):
+        self.engine = engine
+        self.SessionFactory = SessionFactory
+        self.retention = retention
+        self.jobs = {}
+        self._scheduler = BackgroundScheduler(
+            timezone='UTC', job_defaults={'coalesce': True, 'max_instances': 1, 'misfire_grace_time': 300})
+
+    @property
+    def running(self):
+        return self._scheduler.running
+
+    def register(self, name, func, min_gap, trigger, **trigger_args):
+        """Schedule func under `name`. A scheduled run is skipped when another
+        worker already started one less than min_gap ago."""
+        self.jobs[name] = (func, min_gap)
+        self._scheduler.add_job(self.run, trigger, args=[name, 'schedule'], id=name,
+                                replace_existing=True, **trigger_args)
+
+    def start(self):
+        if not self._scheduler.running:
+            self._scheduler.start()
+
+    def shutdown(self):
+        if self._scheduler.running:
+            self._scheduler.shutdown(wait=False)
+
+    def enqueue(self, name):
+        """Run a job as soon as possible on the scheduler thread pool."""
+        if name not in self.jobs:
+            raise KeyError(name)
+        self._scheduler.add_job(self.run, args=[name, 'manual'], id=f'{name}:manual', replace_existing=True)
+
+    def _ran_recently(self, name, min_gap):
+        s = self.SessionFactory()
+        try:
+            return s.query(JobRun.id).filter(
+                JobRun.job_name == name,
+                JobRun.trigger == 'schedule',
+                JobRun.started_at > datetime.utcnow() - min_gap,
+            ).first() is not None
+        finally:
+            s.close()
+
+    def _record(self, run_id=None, **values):
+        s = self.SessionFactory()
+        try:
+            if run_id is None:
+                run = JobRun(**values)
+                s.add(run)
+                s.commit()
+                return run.id
+            s.query(JobRun).filter_by(id=run_id).update(values)
+            s.commit()
+            return run_id
+        finally:
+            s.close()
+
+    def _prune(self, name):
+        # Frequent jobs (drain-outbox runs every minute) would otherwise grow job_runs without bound
+        s = self.SessionFactory()
+        try:
+            s.execute(delete(JobRun).where(JobRun.job_name == name,
+                                           JobRun.started_at < datetime.utcnow() - self.retention))
+            s.commit()
+        finally:
+            s.close()
+
+    def run(self, name, trigger='manual'):
+        """Run job `name` if this process is the leader; returns the JobRun id or None."""
+        func, min_gap = self.jobs[name]
+        with leader_lock(self.engine, name) as leader:
+            if not leader:
+                if trigger == 'manual':
+                    # The endpoint already answered 202; leave a trace of the dropped request
+                    now = datetime.utcnow()
+                    self._record(job_name=name, trigger=trigger, owner=OWNER, started_at=now, finished_at=now,
+                                 duration_ms=0, ok=False, error='skipped: already running in another worker')
+                return None
+            if trigger == 'schedule' and min_gap and self._ran_recently(name, min_gap):
+                return None
+            run_id = self._record(job_name=name, trigger=trigger, owner=OWNER, started_at=datetime.utcnow())
+            t0 = time.monotonic()
+            values = {}
+            try:
+                result = func()
+                values.update(ok=True, result=json.dumps(result, default=str))
+            except Exception as e:
+                print(f'Job {name} failed:', e)
+                values.update(ok=False, error=str(e))
+            values.update(finished_at=datetime.utcnow(), duration_ms=int((time.monotonic() - t0) * 1000))
+            self._record(run_id, **values)
+            if self.retention:
+                self._prune(name)
+            return run_id
+
+    def get_run(self, run_id):
+        s = self.SessionFactory()
+        try:
+            r = s.get(JobRun, run_id)
+            return _run_json(r) if r else None
+        finally:
+            s.close()
+
+    def recent_runs(self, limit=50):
+        s = self.SessionFactory()
+        try:
+            return [_run_json(r) for r in s.query(JobRun).order_by(JobRun.id.desc()).limit(limit)]
+        finally:
+            s.close()
+
+def _run_json(r):
+    return {
+        'id': r.id, 'job': r.job_name, 'trigger': r.trigger, 'owner': r.owner,
+        'started_at': r.started_at.isoformat(), 'duration_ms': r.duration_ms,
+        'ok': r.ok, 'result': json.loads(r.result) if r.result else None, 'error': r.error,
+    }
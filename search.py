@@ -0,0 +1,123 @@
+import re
+
+from sqlalchemy import column, func, literal_column, table, text
+from sqlalchemy.exc import OperationalError
+
+from models import EmailItem
+
+# Dialects whose full-text index is known to exist; others use ILIKE.
+_enabled = set()
+_detected = set()
+
+_PG_DDL = [
+    """ALTER TABLE email_items ADD COLUMN IF NOT EXISTS search_vector tsvector
+       GENERATED ALWAYS AS (
+         setweight(to_tsvector('english', coalesce(subject, '')), 'A') ||
+         setweight(to_tsvector('english', coalesce(sender, '')), 'B') ||
+         setweight(to_tsvector('english', coalesce(snippet, '')), 'C')
+       ) STORED""",
+    "CREATE INDEX IF NOT EXISTS ix_email_items_search ON email_items USING GIN (search_vector)",
+]
+
+# External-content FTS5 table kept in sync with email_items by triggers
+_SQLITE_DDL = [
+    """CREATE VIRTUAL TABLE email_items_fts USING fts5(
+         subject, snippet, sender, content='email_items', content_rowid='id')""",
+    """CREATE TRIGGER email_items_fts_ai AFTER INSERT ON email_items BEGIN
+         INSERT INTO email_items_fts(rowid, subject, snippet, sender)
+         VALUES (new.id, new.subject, new.snippet, new.sender);
+       END""",
+    """CREATE TRIGGER email_items_fts_ad AFTER DELETE ON email_items BEGIN
+         INSERT INTO email_items_fts(email_items_fts, rowid, subject, snippet, sender)
+         VALUES ('delete', old.id, old.subject, old.snippet, old.sender);
+       END""",
+    """CREATE TRIGGER email_items_fts_au AFTER UPDATE OF subject, snippet, sender ON email_items BEGIN
+         INSERT INTO email_items_fts(email_items_fts, rowid, subject, snippet, sender)
+         VALUES ('delete', old.id, old.subject, old.snippet, old.sender);
+         INSERT INTO email_items_fts(rowid, subject, snippet, sender)
+         VALUES (new.id, new.subject, new.snippet, new.sender);
+       END""",
+    "INSERT INTO email_items_fts(email_items_fts) VALUES ('rebuild')",
+]
+
+_fts = table('email_items_fts', column('rowid'), column('rank'))
+
+def install(engine):
+    """Create the full-text index for email_items if needed (idempotent)."""
+    dialect = engine.dialect.name
+    try:
+        with engine.begin() as conn:
+            if dialect == 'postgresql':
+                for ddl in _PG_DDL:
+                    conn.execute(text(ddl))
+            elif dialect == 'sqlite':
+                exists = conn.execute(text(
+                    "SELECT 1 FROM sqlite_master WHERE type='table' AND name='email_items_fts'")).first()
+                if not exists:
+                    for ddl in _SQLITE_DDL:
+                        conn.execute(text(ddl))
+            else:
+                return False
+    except OperationalError as e:
+        print('Full-text index unavailable, falling back to ILIKE:', e)
+        return False
+    _enabled.add(dialect)
+    return True
+
+def detect(engine):
+    """Enable full-text search if migrations already installed the index.
+
+    Checked once per process, on the first search, so startup does not wait on it.
+    """
+    dialect = engine.dialect.name
+    if dialect in _detected:
+        return dialect in _enabled
+    if dialect == 'postgresql':
+        sql = "SELECT 1 FROM pg_indexes WHERE tablename = 'email_items' AND indexname = 'ix_email_items_search'"
+    elif dialect == 'sqlite':
+        sql = "SELECT 1 FROM sqlite_master WHERE type='table' AND name='email_items_fts'"
+    else:
+        sql = None
+    if sql:
+        with engine.connect() as conn:
+            if conn.execute(text(sql)).first():
+                _enabled.add(dialect)
+    _detected.add(dialect)
+    return dialect in _enabled
+
+def _fts5_query(kw):
+    # Quote every word so user input can't inject FTS5 syntax; prefix-match each term
+    return ' '.join(f'"{t}"*' for t in re.findall(r'\w+', kw))
+
+def _pg_terms(kw):
+    tsq = func.websearch_to_tsquery(literal_column("'english'::regconfig"), kw)
+    return literal_column('email_items.search_vector'), tsq
+
+def relevance(kw, dialect):
+    """(expression, descending) ordering matches of apply() by relevance, or None
+    when the index is unavailable and results can only be ordered by recency."""
+    if dialect == 'postgresql' and dialect in _enabled:
+        vector, tsq = _pg_terms(kw)
+        return func.ts_rank_cd(vector, tsq), True
+    if dialect == 'sqlite' and dialect in _enabled and _fts5_query(kw):
+        return _fts.c.rank, False
+    return None
+
+def apply(query, kw, dialect):
+    """Filter an EmailItem query by keywords; relevance() gives the matching order."""
+    if dialect == 'postgresql' and dialect in _enabled:
+        vector, tsq = _pg_terms(kw)
+        return query.filter(vector.op('@@')(tsq))
+    if dialect == 'sqlite' and dialect in _enabled:
+        match = _fts5_query(kw)
+        if not match:
+            return query
+        return query.join(_fts, _fts.c.rowid == EmailItem.id).filter(
+            literal_column('email_items_fts').op('MATCH')(match))
+
+    like = f"%{kw}%"
+    return query.filter(
+        (EmailItem.subject.ilike(like)) |
+        (EmailItem.snippet.ilike(like)) |
+        (EmailItem.sender.ilike(like))
+    )
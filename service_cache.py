@@ -0,0 +1,91 @@
+import threading
+from datetime import datetime, timedelta
+
+from metrics import METRICS
+
+# The Google client stack (discovery, httplib2, google-auth transports) is
+# imported on first use so web processes that never call Google start fast.
+
+# Refresh a little before Google's own per-request threshold so refreshes happen
+# once here (under the single-flight lock) instead of in every request thread.
+REFRESH_MARGIN = timedelta(minutes=5)
+
+def _needs_refresh(creds):
+    if not creds.valid:
+        return True
+    return creds.expiry is not None and creds.expiry - datetime.utcnow() < REFRESH_MARGIN
+
+def build_service(api, version, creds):
+    """Build a discovery client whose requests use one authorized Http per thread.
+
+    httplib2.Http is not thread-safe, so a cached client shared across gunicorn
+    threads must not share a single connection object. Discovery documents come
+    from the copies bundled with google-api-python-client, never over the network.
+    """
+    import httplib2
+    from google_auth_httplib2 import AuthorizedHttp
+    from googleapiclient.discovery import build
+    from googleapiclient.http import HttpRequest
+
+    local = threading.local()
+
+    def _request_builder(http, *args, **kwargs):
+        if getattr(local, 'http', None) is None:
+            local.http = AuthorizedHttp(creds, http=httplib2.Http())
+        return HttpRequest(local.http, *args, **kwargs)
+
+    return build(api, version, credentials=creds, requestBuilder=_request_builder,
+                 static_discovery=True, cache_discovery=False)
+
+class ServiceCache:
+    """Process-wide, thread-safe cache of (credentials, service) keyed by (api, account)."""
+    def __init__(self):
+        self._entries = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def get(self, key, load_credentials, make_service, save_credentials=None):
+        entry = self._entries.get(key)
+        if entry and not _needs_refresh(entry[0]):
+            METRICS.inc('service_cache_requests_total', api=key[0], result='hit')
+            return entry[1]
+
+        from google.auth.transport.requests import Request
+
+        # Single flight: one thread per key loads or refreshes, the rest wait for it.
+        with self._key_lock(key):
+            entry = self._entries.get(key)
+            if entry and not _needs_refresh(entry[0]):
+                return entry[1]
+            if entry and entry[0].refresh_token:
+                METRICS.inc('service_cache_requests_total', api=key[0], result='refresh')
+                creds, svc = entry
+                creds.refresh(Request())
+            else:
+                METRICS.inc('service_cache_requests_total', api=key[0], result='miss')
+                creds = load_credentials()
+                if creds and _needs_refresh(creds) and creds.refresh_token:
+                    creds.refresh(Request())
+                else:
+                    save_credentials = None
+                svc = make_service(creds)
+            if save_credentials:
+                save_credentials(creds)
+            with self._lock:
+                self._entries[key] = (creds, svc)
+            return svc
+
+    def invalidate(self, account):
+        with self._lock:
+            for key in [k for k in self._entries if k[1] == account]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+SERVICE_CACHE = ServiceCache()
@@ -1,67 +1,512 @@
-from datetime import datetime, timedelta
-from models import EmailItem, Photo, Status
-from email_utils import build_notification_html, build_daily_summary_html
+import hashlib
+import json
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from sqlalchemy import update
+from sqlalchemy.orm import load_only, selectinload
+from sqlalchemy.exc import IntegrityError
+from models import EmailItem, EmailMessage, Photo, Status, SyncState, Notification, OutboxStatus
+from gmail_client import HistoryExpiredError
+from email_utils import build_notification_html, build_daily_summary_html, build_digest_html
+from metrics import METRICS, stage
+from view_cache import bump_version
+import classifier
+import rollups
+import thumbnails
 
 KEYWORDS_QUERY = 'newer_than:14d ("damage" OR "credit" OR "replacement")'
+SCAN_CHUNK_SIZE = 20  # messages fetched per batch round trip during a scan
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_MAX_ATTEMPTS = 6
+OUTBOX_RETRY_BASE = timedelta(minutes=1)  # doubled after every failed attempt
+OUTBOX_CLAIM_LEASE = timedelta(minutes=10)  # claimed rows are retried after this if the drain dies mid-send
+BACKFILL_BATCH_SIZE = 500
+SUMMARY_MAX_ITEMS = 100  # items listed in the daily summary; the counts cover all of them
+PENDING_RECHECK = timedelta(hours=1)  # how long a new message not yet searchable is looked for again
+SEARCH_OVERLAP = timedelta(hours=1)  # incremental searches reach this far before the checkpoint
 
 def send_kenect_sms(phone_number: str, message: str):
     # Placeholder for Kenect API call
     print(f"[Kenect placeholder] Would send SMS to {phone_number}: {message}")
 
-def scan_gmail_accounts(session, gmail_mgr, drive_mgr, CFG):
-    updated = 0
+def _known_message_ids(session, ids):
+    """Ids already stored, either as an item of their own or folded into a thread item."""
+    if not ids:
+        return set()
+    known = {r[0] for r in session.query(EmailItem.gmail_message_id).filter(EmailItem.gmail_message_id.in_(ids))}
+    known.update(r[0] for r in session.query(EmailMessage.gmail_message_id)
+                 .filter(EmailMessage.gmail_message_id.in_(ids)))
+    return known
+
+def _new_messages(session, gmail_mgr, account, CFG):
+    """Return search hits ({'id', 'threadId'}) for account that are not yet tracked.
+
+    Uses the stored historyId checkpoint to skip the search entirely when nothing
+    was added since the last scan, and otherwise limits the keyword search to mail
+    received since the checkpoint. Falls back to the full KEYWORDS_QUERY when
+    there is no checkpoint or Gmail reports it as expired. Search indexing can lag
+    the history feed, so new messages the search cannot see yet are kept on the
+    checkpoint and checked again on later scans for up to PENDING_RECHECK.
+    """
+    state = session.query(SyncState).filter_by(account_email=account).first()
+    if state is None:
+        state = SyncState(account_email=account)
+        session.add(state)
+
+    pending = json.loads(state.pending_ids) if state.pending_ids else {}
+    added = None
+    if state.history_id:
+        try:
+            added, latest = gmail_mgr.list_history(account, state.history_id)
+        except HistoryExpiredError:
+            added = None
+    max_results = CFG.get('SCAN_MAX_RESULTS', 100)
+    if added is None:
+        # Take the checkpoint before searching so nothing arriving mid-scan is skipped
+        latest = gmail_mgr.get_history_id(account)
+        msgs = gmail_mgr.search_messages(account, KEYWORDS_QUERY, max_results=max_results)
+        pending = {}  # the full search covers them
+    elif not added and not pending:
+        state.history_id = latest
+        return []
+    else:
+        now = datetime.utcnow()
+        delta = set(added) | set(pending)
+        since = min([state.updated_at or now] + [datetime.fromisoformat(t) for t in pending.values()])
+        after = f'after:{int((since - SEARCH_OVERLAP).replace(tzinfo=timezone.utc).timestamp())}'
+        msgs = [m for m in gmail_mgr.search_messages(account, f'{KEYWORDS_QUERY} {after}', max_results=max_results)
+                if m['id'] in delta]
+        missing = delta - {m['id'] for m in msgs}
+        if missing:
+            # A missing id the search can already see just does not match; keep only the unindexed ones
+            indexed = {m['id'] for m in gmail_mgr.search_messages(account, after, max_results=max_results)}
+            pending = {i: pending.get(i, now.isoformat()) for i in missing - indexed}
+            pending = {i: t for i, t in pending.items() if now - datetime.fromisoformat(t) < PENDING_RECHECK}
+        else:
+            pending = {}
+    known = _known_message_ids(session, [m['id'] for m in msgs])
+    state.history_id = latest
+    state.pending_ids = json.dumps(pending) if pending else None
+    return [m for m in msgs if m['id'] not in known]
+
+def scan_gmail_accounts(SessionFactory, gmail_mgr, drive_mgr, CFG):
+    """Scan all monitored accounts on a bounded thread pool.
+
+    Returns {account: {'ok': bool, 'updated': int, 'error': str}}; one failing
+    inbox no longer aborts the others.
+    """
     accounts = [a.strip() for a in CFG['MONITORED_GMAIL_ACCOUNTS'].split(',') if a.strip()]
-    service_account = CFG['SERVICE_GOOGLE_ACCOUNT']
-
-    for account in accounts:
-        msgs = gmail_mgr.search_messages(account, KEYWORDS_QUERY, max_results=100)
-        for m in msgs:
-            msg_id = m['id']
-            exists = session.query(EmailItem).filter_by(gmail_message_id=msg_id).first()
-            if exists:
-                continue
-            full = gmail_mgr.get_message(account, msg_id)
-            headers = {h['name'].lower(): h['value'] for h in full.get('payload', {}).get('headers', [])}
-            sender = headers.get('from','(unknown)')
-            subject = headers.get('subject','(no subject)')
-            date = headers.get('date','')
-            snippet = full.get('snippet','')
-
-            item = EmailItem(gmail_message_id=msg_id, thread_id=full.get('threadId'),
-                             account_email=account, sender=sender, subject=subject, date=date,
-                             snippet=snippet, status=Status.NEW)
-            session.add(item)
+    if not accounts:
+        return {}
+    session = SessionFactory()
+    try:
+        # Trained once per scan from staff decisions so far, shared read-only by every worker
+        clf = classifier.build(session, CFG)
+    finally:
+        session.close()
+    workers = max(1, min(CFG['SCAN_ACCOUNT_WORKERS'], len(accounts)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='scan-account') as pool:
+        futures = {a: pool.submit(_scan_account, SessionFactory, gmail_mgr, drive_mgr, CFG, a, clf) for a in accounts}
+        return {a: f.result() for a, f in futures.items()}
+
+def _scan_account(SessionFactory, gmail_mgr, drive_mgr, CFG, account, clf=None):
+    session = SessionFactory()
+    updated = low = 0
+    try:
+        new = _new_messages(session, gmail_mgr, account, CFG)
+        workers = max(1, CFG['SCAN_MESSAGE_WORKERS'])
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='scan-message') as pool:
+            if CFG.get('SCAN_THREAD_MODE'):
+                # One threads.get per thread instead of one messages.get per matching reply
+                thread_ids = list(dict.fromkeys(m['threadId'] for m in new))
+                for start in range(0, len(thread_ids), SCAN_CHUNK_SIZE):
+                    threads = gmail_mgr.get_threads(account, thread_ids[start:start + SCAN_CHUNK_SIZE])
+                    unseen = _unseen_thread_messages(session, threads)
+                    verdicts = _thread_verdicts(session, clf, account, unseen)
+                    low += sum(_is_low(v) for v in verdicts)
+                    atts_by_msg = _fetch_new_attachments(session, gmail_mgr, account, [
+                        m for msgs, v in zip(unseen, verdicts) if not _is_low(v) for m in msgs])
+                    futures = [pool.submit(_ingest_in_session, SessionFactory, drive_mgr, gmail_mgr, CFG,
+                                           account, msgs, atts_by_msg, _ingest_thread, verdict=v)
+                               for msgs, v in zip(unseen, verdicts)]
+                    stored, error = _collect(futures)
+                    updated += stored
+                    if error:
+                        raise error
+            else:
+                new_ids = [m['id'] for m in new]
+                for start in range(0, len(new_ids), SCAN_CHUNK_SIZE):
+                    chunk = gmail_mgr.get_messages(account, new_ids[start:start + SCAN_CHUNK_SIZE])
+                    verdicts = _classify(clf, chunk)
+                    low += sum(_is_low(v) for v in verdicts)
+                    # Low-priority matches never reach the attachment, Drive and notification paths
+                    atts_by_msg = _fetch_new_attachments(session, gmail_mgr, account, [
+                        full for full, v in zip(chunk, verdicts) if not _is_low(v)])
+                    futures = [pool.submit(_ingest_in_session, SessionFactory, drive_mgr, gmail_mgr, CFG,
+                                           account, full, atts_by_msg.get(full['id'], []), verdict=v)
+                               for full, v in zip(chunk, verdicts)]
+                    # Count what the other workers committed before surfacing a failure
+                    stored, error = _collect(futures)
+                    updated += stored
+                    if error:
+                        raise error
+        if updated:
+            bump_version(session)
+        # Only advance the history checkpoint once every new message is stored
+        session.commit()
+        METRICS.inc('scan_items_total', updated, account=account)
+        METRICS.inc('scan_low_priority_total', low, account=account)
+        return {'ok': True, 'updated': updated, 'low_priority': low}
+    except Exception as e:
+        session.rollback()
+        print(f'Scan error for {account}:', e)
+        if updated:
+            # Items stored before the failure are committed; show them without the checkpoint
+            bump_version(session)
+            session.commit()
+        return {'ok': False, 'updated': updated, 'error': str(e)}
+    finally:
+        session.close()
+
+def _collect(futures):
+    """Wait for every _ingest_in_session future; return (items stored, first error or None)."""
+    count, error = 0, None
+    for f in futures:
+        try:
+            count += f.result()
+        except Exception as e:
+            error = error or e
+    return count, error
+
+@stage('classify')
+def _classify(clf, messages):
+    """One classifier.Verdict per message (None everywhere when the classifier is off)."""
+    return [clf.classify(m) if clf else None for m in messages]
+
+def _is_low(verdict):
+    return verdict is not None and verdict.priority == classifier.PRIORITY_LOW
+
+def _thread_verdicts(session, clf, account, unseen):
+    """A thread already tracked keeps its item's priority; a new one takes the
+    best verdict among its messages."""
+    if clf is None:
+        return [None] * len(unseen)
+    tracked = dict(session.query(EmailItem.thread_id, EmailItem.priority)
+                   .filter(EmailItem.account_email == account,
+                           EmailItem.thread_id.in_({msgs[0].get('threadId') for msgs in unseen})))
+    verdicts = []
+    for msgs in unseen:
+        thread_id = msgs[0].get('threadId')
+        if thread_id in tracked:
+            priority = tracked[thread_id] or classifier.PRIORITY_NORMAL
+            verdicts.append(classifier.Verdict(None, priority, ['tracked thread']))
+        else:
+            verdicts.append(max(_classify(clf, msgs), key=lambda v: v.score))
+    return verdicts
+
+def _unseen_thread_messages(session, threads):
+    """Per thread, the messages not stored yet (oldest first); threads with none are dropped."""
+    known = _known_message_ids(session, [m['id'] for t in threads for m in t.get('messages', [])])
+    unseen = ([m for m in t.get('messages', []) if m['id'] not in known] for t in threads)
+    return [msgs for msgs in unseen if msgs]
+
+def _meta_key(filename, size, part_id):
+    return (filename, str(size), part_id)
+
+def _fetch_new_attachments(session, gmail_mgr, account, messages):
+    """Return {message_id: [attachment]}, downloading only parts not seen before.
+
+    A part whose filename, size and partId match a stored photo with a content
+    hash reuses that photo's Drive file instead of being downloaded again.
+    """
+    parts = [p for m in messages for p in gmail_mgr.attachment_parts(m)]
+    known = {}
+    if parts:
+        rows = (session.query(Photo.filename, Photo.size, Photo.part_id, Photo.content_hash,
+                              Photo.drive_file_id, Photo.web_view_link, Photo.web_content_link)
+                .filter(Photo.filename.in_({p['filename'] for p in parts}),
+                        Photo.content_hash.isnot(None), Photo.drive_file_id.isnot(None)))
+        for r in rows:
+            known[_meta_key(r.filename, r.size, r.part_id)] = {
+                'content_hash': r.content_hash, 'drive_file_id': r.drive_file_id,
+                'web_view_link': r.web_view_link, 'web_content_link': r.web_content_link}
+
+    to_fetch = [p for p in parts if _meta_key(p['filename'], p['size'], p['partId']) not in known]
+    downloaded = iter(gmail_mgr.download_attachments(account, to_fetch))
+    out = {m['id']: [] for m in messages}
+    for p in parts:
+        match = known.get(_meta_key(p['filename'], p['size'], p['partId']))
+        if match:
+            out[p['messageId']].append(dict(match, filename=p['filename'], mimeType=p['mimeType'],
+                                            partId=p['partId'], size=str(p['size']), data=None))
+        else:
+            out[p['messageId']].append(next(downloaded))
+    return out
+
+def _resolve_drive_files(session, drive_mgr, email, atts):
+    """Fill in Drive file info for each attachment, uploading only unseen content."""
+    for att in atts:
+        if att.get('data') is not None:
+            att['content_hash'] = hashlib.sha256(att['data']).hexdigest()
+    links = {att['content_hash']: (att['drive_file_id'], att['web_view_link'], att['web_content_link'])
+             for att in atts if att.get('drive_file_id')}
+    hashes = {att['content_hash'] for att in atts} - set(links)
+    if hashes:
+        rows = (session.query(Photo.content_hash, Photo.drive_file_id, Photo.web_view_link, Photo.web_content_link)
+                .filter(Photo.content_hash.in_(hashes), Photo.drive_file_id.isnot(None)))
+        for r in rows:
+            links.setdefault(r.content_hash, (r.drive_file_id, r.web_view_link, r.web_content_link))
+
+    uploads = {}
+    for att in atts:
+        if att['content_hash'] not in links:
+            uploads.setdefault(att['content_hash'], att)
+    if uploads:
+        pending = list(uploads.values())
+        for att, result in zip(pending, drive_mgr.upload_photos(email, pending)):
+            if isinstance(result, Exception):
+                print('Drive upload error:', result)
+            else:
+                links[att['content_hash']] = result
+    return links
+
+def _ingest_in_session(SessionFactory, drive_mgr, gmail_mgr, CFG, account, full, atts, ingest=None, **kw):
+    session = SessionFactory()
+    try:
+        count, deltas = (ingest or _ingest_message)(session, drive_mgr, gmail_mgr, CFG, account, full, atts, **kw)
+        # Last statements before the commit, after Drive and thumbnail work: the rollup
+        # rows are shared by every writer, so their row locks are held only for the commit
+        rollups.add(session, deltas)
+        with stage('db_flush'):
+            session.commit()
+        return count
+    except IntegrityError:
+        session.rollback()
+        # Idempotent only for a message another worker or process already stored; any
+        # other constraint failure must fail the scan so the checkpoint does not skip it
+        ids = [m['id'] for m in full] if isinstance(full, list) else [full['id']]
+        if _known_message_ids(session, ids):
+            return 0
+        raise
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+def _message_fields(full):
+    headers = {h['name'].lower(): h['value'] for h in full.get('payload', {}).get('headers', [])}
+    date = headers.get('date','')
+    return {'sender': headers.get('from','(unknown)'), 'subject': headers.get('subject','(no subject)'),
+            'date': date, 'snippet': full.get('snippet',''), 'received_at': _received_at(full, date)}
+
+def _add_photos(session, drive_mgr, CFG, item, atts):
+    photos = []
+    links = _resolve_drive_files(session, drive_mgr, CFG['SERVICE_GOOGLE_ACCOUNT'], atts)
+    for att in atts:
+        if att['content_hash'] not in links:
+            continue
+        fid, view, content = links[att['content_hash']]
+        p = Photo(email_item_id=item.id, filename=att['filename'], mime_type=att['mimeType'], size=att['size'],
+                  drive_file_id=fid, web_view_link=view, web_content_link=content,
+                  content_hash=att['content_hash'], part_id=att.get('partId'))
+        session.add(p); photos.append(p)
+        if att.get('data') is not None and CFG.get('THUMBNAILS_AT_INGEST'):
+            # The bytes are already in memory; render now rather than re-downloading from Drive later
+            thumbnails.store_from_bytes(session, att['content_hash'], att['data'])
+    return photos
+
+def _verdict_fields(verdict):
+    if verdict is None:
+        return {'priority': classifier.PRIORITY_NORMAL}
+    return {'priority': verdict.priority, 'score': verdict.score}
+
+def _new_item_deltas(item):
+    return Counter({(rollups.item_day(item.received_at), item.account_email, Status.NEW): 1})
+
+def _ingest_message(session, drive_mgr, gmail_mgr, CFG, account, full, atts, verdict=None):
+    """Store one message as an item; returns (items stored, rollup deltas)."""
+    fields = _message_fields(full)
+    item = EmailItem(gmail_message_id=full['id'], thread_id=full.get('threadId'), account_email=account,
+                     status=Status.NEW, **fields, **_verdict_fields(verdict))
+    session.add(item)
+    with stage('db_flush'):
+        session.flush()
+    if _is_low(verdict):
+        return 1, _new_item_deltas(item)
+
+    photos = _add_photos(session, drive_mgr, CFG, item, atts)
+    _enqueue_notification(session, CFG, f"Damage Tracker: {item.subject}", build_notification_html(item, photos),
+                          email_item_id=item.id)
+    return 1, _new_item_deltas(item)
+
+def _ingest_thread(session, drive_mgr, gmail_mgr, CFG, account, msgs, atts_by_msg, verdict=None):
+    """Fold a thread's unseen messages into its item, creating the item (and its
+    one notification) on first sight. Replies only append messages and photos.
+    Returns (1, rollup deltas), the deltas empty for a reply."""
+    thread_id = msgs[0].get('threadId')
+    item = (session.query(EmailItem).filter_by(account_email=account, thread_id=thread_id)
+            .order_by(EmailItem.id).first())
+    created = item is None
+    if created:
+        item = EmailItem(gmail_message_id=msgs[0]['id'], thread_id=thread_id, account_email=account,
+                         status=Status.NEW, **_message_fields(msgs[0]), **_verdict_fields(verdict))
+        session.add(item)
+        with stage('db_flush'):
             session.flush()
 
-            atts = gmail_mgr.fetch_attachments(account, full)
-            photos = []
-            for att in atts:
-                try:
-                    fid, view, content = drive_mgr.upload_photo(service_account, att['filename'], att['mimeType'], att['data'])
-                    p = Photo(email_item_id=item.id, filename=att['filename'], mime_type=att['mimeType'], size=att['size'],
-                              drive_file_id=fid, web_view_link=view, web_content_link=content)
-                    session.add(p); photos.append(p)
-                except Exception as e:
-                    print('Drive upload error:', e)
-
-            try:
-                html = build_notification_html(item, photos)
-                tos = [t.strip() for t in CFG['NOTIFY_EMAILS'].split(',') if t.strip()]
-                gmail_mgr.send_email(CFG['SERVICE_GOOGLE_ACCOUNT'], tos, subject=f"Damage Tracker: {subject}", html_body=html)
-            except Exception as e:
-                print('Notification send error:', e)
-
-            updated += 1
-    return updated
+    for full in msgs:
+        fields = _message_fields(full)
+        session.add(EmailMessage(email_item_id=item.id, gmail_message_id=full['id'], sender=fields['sender'],
+                                 date=fields['date'], snippet=fields['snippet'], received_at=fields['received_at']))
+    photos = _add_photos(session, drive_mgr, CFG, item, [a for full in msgs for a in atts_by_msg.get(full['id'], [])])
+    with stage('db_flush'):
+        session.flush()
 
-def send_daily_summary(session, gmail_mgr, CFG):
-    since = datetime.utcnow() - timedelta(days=1)
-    items = session.query(EmailItem).filter(EmailItem.created_at >= since).order_by(EmailItem.created_at.desc()).all()
-    html = build_daily_summary_html(items)
-    tos = [t.strip() for t in CFG['NOTIFY_EMAILS'].split(',') if t.strip()]
+    if created and not _is_low(verdict):
+        _enqueue_notification(session, CFG, f"Damage Tracker: {item.subject}", build_notification_html(item, photos),
+                              email_item_id=item.id)
+    return 1, _new_item_deltas(item) if created else Counter()
+
+def _parse_date_header(value):
+    """RFC 822 Date header as a naive UTC datetime, or None if unparseable."""
     try:
-        gmail_mgr.send_email(CFG['SERVICE_GOOGLE_ACCOUNT'], tos, subject="Damage Tracker: Daily Summary", html_body=html)
-        return True
-    except Exception as e:
-        print('Daily summary send error:', e)
+        dt = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if dt is not None and dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+def _received_at(full, date_header):
+    """Gmail internalDate (ms since epoch) as naive UTC, else the Date header, else now."""
+    if full.get('internalDate'):
+        return datetime.fromtimestamp(int(full['internalDate']) / 1000, timezone.utc).replace(tzinfo=None)
+    return _parse_date_header(date_header) or datetime.utcnow()
+
+def backfill_received_at(session, batch_size=BACKFILL_BATCH_SIZE):
+    """Fill received_at on rows stored before it existed, committing one batch at a time.
+
+    Uses the stored Date header, falling back to created_at.
+    """
+    updated, last_id = 0, 0
+    while True:
+        rows = (session.query(EmailItem.id, EmailItem.date, EmailItem.created_at, EmailItem.account_email,
+                              EmailItem.status)
+                .filter(EmailItem.received_at.is_(None), EmailItem.id > last_id)
+                .order_by(EmailItem.id).limit(batch_size).all())
+        if not rows:
+            return {'updated': updated}
+        values, deltas = [], Counter()
+        for r in rows:
+            received_at = _parse_date_header(r.date) or r.created_at or datetime.utcnow()
+            values.append({'id': r.id, 'received_at': received_at})
+            # Rollups counted the row under its created_at day until now
+            deltas[(rollups.item_day(None, r.created_at), r.account_email, r.status)] -= 1
+            deltas[(rollups.item_day(received_at), r.account_email, r.status)] += 1
+        session.execute(update(EmailItem), values)
+        rollups.add(session, deltas)
+        bump_version(session)
+        session.commit()
+        updated += len(rows)
+        last_id = rows[-1].id
+
+def _enqueue_notification(session, CFG, subject, html, kind='item', email_item_id=None):
+    tos = [t.strip() for t in CFG['NOTIFY_EMAILS'].split(',') if t.strip()]
+    if not tos:
+        return None
+    n = Notification(kind=kind, subject=subject, html_body=html, recipients=','.join(tos),
+                     email_item_id=email_item_id)
+    session.add(n)
+    return n
+
+def _mark_failed(n, error, now):
+    n.attempts += 1
+    n.last_error = str(error)
+    if n.attempts >= OUTBOX_MAX_ATTEMPTS:
+        n.status = OutboxStatus.FAILED
+    else:
+        n.next_attempt_at = now + OUTBOX_RETRY_BASE * (2 ** (n.attempts - 1))
+
+def drain_outbox(session, gmail_mgr, CFG):
+    """Send due outbox notifications, one messages.send per notification (or per
+    digest when NOTIFY_DIGEST is set). Failures are retried with exponential
+    backoff until OUTBOX_MAX_ATTEMPTS. Returns {'sent': n, 'failed': n}.
+
+    Rows are claimed before sending by pushing next_attempt_at out by
+    OUTBOX_CLAIM_LEASE, so a concurrent drain does not pick them up once the
+    row locks are released by the per-group commits."""
+    now = datetime.utcnow()
+    due = (session.query(Notification)
+           .filter(Notification.status == OutboxStatus.PENDING, Notification.next_attempt_at <= now)
+           .order_by(Notification.id)
+           .limit(OUTBOX_BATCH_SIZE)
+           .with_for_update(skip_locked=True)
+           .all())
+    if not due:
+        session.commit()
+        return {'sent': 0, 'failed': 0}
+    ids = [n.id for n in due]
+    for n in due:
+        n.next_attempt_at = now + OUTBOX_CLAIM_LEASE
+    session.commit()
+    # Reload the claimed rows in one query (the commit expired them)
+    due = session.query(Notification).filter(Notification.id.in_(ids)).order_by(Notification.id).all()
+
+    groups = []
+    if CFG.get('NOTIFY_DIGEST'):
+        items_by_recipients = {}
+        for n in due:
+            if n.kind == 'item':
+                items_by_recipients.setdefault(n.recipients, []).append(n)
+            else:
+                groups.append([n])
+        groups.extend(items_by_recipients.values())
+    else:
+        groups = [[n] for n in due]
+
+    sent = failed = 0
+    for group in groups:
+        first = group[0]
+        if len(group) == 1:
+            subject, html = first.subject, first.html_body
+        else:
+            subject = f"Damage Tracker: {len(group)} new items"
+            html = build_digest_html([n.html_body for n in group])
+        try:
+            gmail_mgr.send_email(CFG['SERVICE_GOOGLE_ACCOUNT'], first.recipients.split(','), subject=subject, html_body=html)
+        except Exception as e:
+            print('Notification send error:', e)
+            for n in group:
+                _mark_failed(n, e, now)
+            failed += len(group)
+        else:
+            for n in group:
+                n.status = OutboxStatus.SENT
+                n.sent_at = datetime.utcnow()
+            sent += len(group)
+        # Record each group as soon as it is sent so a later failure cannot resend it
+        session.commit()
+    return {'sent': sent, 'failed': failed}
+
+def daily_summary_items(session, days=1, limit=SUMMARY_MAX_ITEMS):
+    """Latest items received in the last `days`, with photo ids in one extra query and no snippets."""
+    since = datetime.utcnow() - timedelta(days=days)
+    return (session.query(EmailItem)
+            .options(load_only(EmailItem.date, EmailItem.sender, EmailItem.subject, EmailItem.status),
+                     selectinload(EmailItem.photos).load_only(Photo.id))
+            .filter(EmailItem.received_at >= since)
+            .order_by(EmailItem.received_at.desc(), EmailItem.id.desc()).limit(limit).all())
+
+def send_daily_summary(session, gmail_mgr, CFG):
+    """Queue the daily summary in the outbox and drain it; a failed send is retried later."""
+    stats = rollups.stats(session, days=8)
+    html = build_daily_summary_html(daily_summary_items(session), stats, rollups.trend(stats), SUMMARY_MAX_ITEMS)
+    n = _enqueue_notification(session, CFG, "Damage Tracker: Daily Summary", html, kind='summary')
+    session.commit()
+    if n is None:
         return False
+    drain_outbox(session, gmail_mgr, CFG)
+    return n.status == OutboxStatus.SENT
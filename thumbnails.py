@@ -0,0 +1,106 @@
+import io
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from db import upsert
+from metrics import stage
+from models import Thumbnail
+
+SIZES = {'sm': 160, 'md': 480, 'lg': 1024}  # longest edge in pixels
+DEFAULT_SIZE = 'md'
+MIME_TYPE = 'image/jpeg'
+JPEG_QUALITY = 80
+
+def source_key(photo):
+    """Thumbnails are shared by every photo with the same bytes; older rows without a hash use the Drive file."""
+    if photo.content_hash:
+        return photo.content_hash
+    if photo.drive_file_id:
+        return f'drive:{photo.drive_file_id}'
+    return None
+
+@stage('thumbnail_render')
+def render_all(data):
+    """Return {size: JPEG bytes} for every size in SIZES, decoding the image once."""
+    try:
+        # Pillow is only needed by the thumbnail endpoint and ingest, not to import the app
+        from PIL import Image, ImageOps
+    except ImportError as e:
+        raise RuntimeError('Pillow is not installed') from e
+
+    with Image.open(io.BytesIO(data)) as img:
+        # Let the JPEG decoder downscale by up to 8x while decoding instead of decoding full size
+        img.draft('RGB', (SIZES['lg'], SIZES['lg']))
+        img = ImageOps.exif_transpose(img).convert('RGB')
+        out = {}
+        for name, px in sorted(SIZES.items(), key=lambda kv: -kv[1]):
+            img.thumbnail((px, px))
+            buf = io.BytesIO()
+            img.save(buf, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+            out[name] = buf.getvalue()
+    return out
+
+def store(session, key, rendered):
+    now = datetime.utcnow()
+    for size, data in rendered.items():
+        upsert(session, Thumbnail, {'source_key': key, 'size': size, 'mime_type': MIME_TYPE, 'data': data,
+                                    'created_at': now},
+               ['source_key', 'size'], {'data': data, 'created_at': now})
+
+def store_from_bytes(session, key, data):
+    """Render and store thumbnails for bytes already in memory (ingest); False if the image is unusable."""
+    try:
+        rendered = render_all(data)
+    except Exception as e:
+        print('Thumbnail error:', e)
+        return False
+    store(session, key, rendered)
+    return True
+
+class ThumbnailCache:
+    """Thread-safe LRU of thumbnail bytes bounded by total size."""
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._entries[key] = data
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+def get_thumbnail(session, drive_mgr, account, photo, size, cache):
+    """Thumbnail bytes for photo: memory, then the database, then one Drive download
+    rendered to every size and stored. Raises RuntimeError if it cannot be made."""
+    key = source_key(photo)
+    if key is None or not photo.drive_file_id:
+        raise RuntimeError(f'Photo {photo.id} has no Drive file')
+    data = cache.get((key, size))
+    if data is not None:
+        return data
+    row = session.get(Thumbnail, (key, size))
+    if row is not None:
+        cache.put((key, size), row.data)
+        return row.data
+    rendered = render_all(drive_mgr.download_file(account, photo.drive_file_id))
+    store(session, key, rendered)
+    session.commit()
+    cache.put((key, size), rendered[size])
+    return rendered[size]
@@ -1,6 +1,8 @@
+import json
+
 from models import OAuthToken
-from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request
+from metrics import METRICS
+from service_cache import SERVICE_CACHE
 
 class DBTokenStore:
     """Stores Google OAuth tokens in the database (works on Render free tier)."""
@@ -16,20 +18,27 @@ class DBTokenStore:
             s.close()
 
     def load(self, email, scopes):
+        from google.oauth2.credentials import Credentials
+        from google.auth.transport.requests import Request
+
         s = self.SessionFactory()
         try:
             row = s.query(OAuthToken).filter_by(email=email).first()
             if not row:
+                METRICS.inc('token_loads_total', result='missing')
                 return None
-            creds = Credentials.from_authorized_user_info(eval(row.token_json), scopes=scopes)
+            creds = Credentials.from_authorized_user_info(json.loads(row.token_json), scopes=scopes)
             if creds and creds.expired and creds.refresh_token:
                 creds.refresh(Request())
                 self.save(email, row.provider, creds)
+                METRICS.inc('token_loads_total', result='refreshed')
+            else:
+                METRICS.inc('token_loads_total', result='ok')
             return creds
         finally:
             s.close()
 
-    def save(self, email, provider, creds: Credentials):
+    def save(self, email, provider, creds):
         s = self.SessionFactory()
         try:
             data = creds.to_json()
@@ -41,4 +50,5 @@ class DBTokenStore:
                 s.add(row)
             s.commit()
         finally:
+            SERVICE_CACHE.invalidate(email)
             s.close()
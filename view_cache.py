@@ -0,0 +1,95 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from db import upsert
+from models import CacheVersion
+
+ITEMS = 'items'  # the tracked-item list: dashboard and /api/items
+
+def bump_version(session, name=ITEMS):
+    """Invalidate cached views of `name` when session's transaction commits."""
+    now = datetime.utcnow()
+    upsert(session, CacheVersion, {'name': name, 'version': 1, 'updated_at': now}, ['name'],
+           {'version': CacheVersion.version + 1, 'updated_at': now})
+
+class ViewCache:
+    """Per-process LRU of rendered views keyed on (data version, request key).
+
+    The version lives in cache_versions so every worker sees bumps committed by
+    any other. It is re-read at most every version_ttl seconds, so polling an
+    unchanged page runs no queries at all.
+    """
+    def __init__(self, SessionFactory, name=ITEMS, version_ttl=2.0, max_entries=256):
+        self.SessionFactory = SessionFactory
+        self.name = name
+        self.version_ttl = version_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._version = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def version(self):
+        now = time.monotonic()
+        if self._version is not None and now - self._checked < self.version_ttl:
+            return self._version
+        s = self.SessionFactory()
+        try:
+            version = s.query(CacheVersion.version).filter_by(name=self.name).scalar() or 0
+        finally:
+            s.close()
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+            self._version, self._checked = version, now
+        return version
+
+    def expire(self):
+        """Re-read the version on the next request (call after committing a bump)."""
+        self._checked = 0.0
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._checked = 0.0
+
+    def etag(self, key, version):
+        return hashlib.sha1(repr((self.name, version, key)).encode()).hexdigest()[:24]
+
+    def get(self, key, version):
+        with self._lock:
+            value = self._entries.get((version, key))
+            if value is not None:
+                self._entries.move_to_end((version, key))
+            return value
+
+    def put(self, key, version, value):
+        with self._lock:
+            self._entries[(version, key)] = value
+            self._entries.move_to_end((version, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+class TTLValue:
+    """Caches fn() for ttl seconds; a failed call is not cached."""
+    def __init__(self, fn, ttl):
+        self.fn = fn
+        self.ttl = ttl
+        self._value = None
+        self._expires = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if time.monotonic() < self._expires:
+                return self._value
+            self._value = self.fn()
+            self._expires = time.monotonic() + self.ttl
+            return self._value
+
+    def clear(self):
+        with self._lock:
+            self._expires = 0.0